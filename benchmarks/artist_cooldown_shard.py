@@ -0,0 +1,61 @@
+"""TicketBotArtistCooldown の1シャードのサイズと読み込み時間を計測する
+
+README の COOLDOWN_MODE=artist に記載している数値はこのスクリプトの出力による。
+
+    python benchmarks/artist_cooldown_shard.py [ユーザー数]
+"""
+import os
+import statistics
+import sys
+import time
+import uuid
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layer', 'common', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'lambda-python3.13', 'check_ticket'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+
+from cooldown import COOLDOWN_SHARD_MAX_BYTES, _entry_size, estimate_shard_size  # noqa: E402
+
+
+def line_user_id():
+    """LINEのユーザーIDと同じ形式（U + 32桁の16進数）の値を生成する"""
+    return 'U' + uuid.uuid4().hex
+
+
+def main(users: int):
+    now = int(time.time())
+    notified = {line_user_id(): now for _ in range(users)}
+    item = {
+        'artist': 'snowman',
+        'shard': 0,
+        'notified': notified,
+        'version': 1,
+        'ExpiresAt': now + 3600
+    }
+    size = estimate_shard_size(item['artist'], notified)
+    capacity = (COOLDOWN_SHARD_MAX_BYTES - estimate_shard_size(item['artist'], {})) // _entry_size(line_user_id(), now)
+
+    # DynamoDB の GetItem / BatchGetItem のレスポンスを Python の値に変換する時間
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    wire = {name: serializer.serialize(value) for name, value in item.items()}
+    times = []
+    for _ in range(20):
+        start = time.perf_counter()
+        {name: deserializer.deserialize(value) for name, value in wire.items()}
+        times.append((time.perf_counter() - start) * 1000)
+
+    print(f"users: {users}")
+    print(f"estimated item size: {size / 1024:.1f} KB (limit {COOLDOWN_SHARD_MAX_BYTES // 1024} KB)")
+    print(f"users per shard: {capacity}")
+    print(f"deserialize: median {statistics.median(times):.1f} ms, max {max(times):.1f} ms")
+    # 強い整合性のない読み込みは 4KB ごとに 0.5 RCU、強い整合性のある読み込みは 1 RCU
+    print(f"read capacity: {size / 4096 / 2:.1f} RCU (eventually consistent), {size / 4096:.1f} RCU (strongly consistent)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
@@ -1,22 +1,30 @@
+import itertools
 import json
 import boto3
-import requests
-from bs4 import BeautifulSoup
 import time
-from boto3.dynamodb.conditions import Key
 
 
+from cooldown import new_cooldown
+from crawler import Crawler
+from dispatcher import MULTICAST_MAX_RECIPIENTS, multicast
+from line_client import LineClient
+from planner import consume_quota, plan_notifications
+from subscribers import iter_subscribers
 from utils import (
-    base_url,
     artists,
     display_names,
     get_ssm_parameter,
-    get_token
+    get_token,
+    prepare_token
 )
 
 
 dynamodb = boto3.resource('dynamodb')
 ssm = boto3.client('ssm')
+crawler = Crawler()
+
+# 初期化フェーズでアクセストークンを取得し、期限が近ければ事前に更新を始める
+prepare_token()
 
 
 def lambda_handler(event, context):
@@ -40,53 +48,19 @@ def lambda_handler(event, context):
 
         Return doc: https://docs.aws.amazon.com/apigateway/latest/developerguide/set-up-lambda-proxy-integrations.html
     """
+    # 通知の権利を確保したアーティストごとのオブジェクト（送信できなかった分は最後に取り消す）
+    cooldowns = []
     try:
-        # 空き状況一覧
-        artist_available_tickets = {}
-
         token = get_token(
             get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
             get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
         )
 
-        # まずアーティストでイテレーションする
-        for artist_name, artist_id in artists.items():
-            # アーティストの空き状況一覧を初期化
-            artist_available_tickets[artist_name] = []
-
-            artist_page_url = f"{base_url}/events/artist/{artist_id}"
-            artist_res = requests.get(artist_page_url)
-            artist_soup = BeautifulSoup(artist_res.text, 'html.parser')
-
-            # アーティストのイベント情報を取得して更にイテレーション
-            events = artist_soup.find_all('a', { 'class': 'd-block' })
-            for event in events:
-                event_url = event.get('href')
-                if not event_url:
-                    continue
-
-                # event_id = event_url.split('/')[-1]
-                event_res = requests.get(f"{base_url}/{event_url}")
-                event_soup = BeautifulSoup(event_res.text, 'html.parser')
-                # perform-listをすべて取得
-                perform_list = event_soup.find_all('div', { 'class': 'perform-list' })
-                for perform in perform_list:
-                    # 日時
-                    perform_date = perform.find('div', { 'class': 'lead' }).text
-                    # 会場
-                    perform_place = perform.find('p').text
-                    # 「購入手続きへ」ボタン（ない場合もある）
-                    buy_button = perform.find('button', { 'class': 'btn' })
-                    # 「購入手続きへ」ボタンが存在する場合、artist_available_ticketsに日時と会場とURLを追加
-                    if buy_button:
-                        print('空きあり', artist_name, perform_date, perform_place, f"{base_url}/{event_url}")
-                        artist_available_tickets[artist_name].append({
-                            'date': perform_date,
-                            'place': perform_place,
-                            'url': f"{base_url}/{event_url}"
-                        })
+        # アーティストページとイベントページを並行して取得する
+        artist_available_tickets = crawler.crawl(artists)
 
-        # ユーザーに空き状況を通知
+        # 空きのあるアーティストごとに通知対象のユーザーを集める
+        notifications = []
         for artist in artist_available_tickets:
             if artist_available_tickets[artist]:
                 message = f"{display_names[artist]} のチケットが見つかりました\n"
@@ -95,77 +69,82 @@ def lambda_handler(event, context):
                     message += f"会場：{ticket['place']}\n"
                     message += f"URL：{ticket['url']}"
 
-                # 通知対象のユーザーを取得
-                table = dynamodb.Table('TicketBotUsers')
-                response = table.query(
-                    IndexName='artist-index',
-                    KeyConditionExpression=Key('artist').eq(artist)
-                )
-                print('query response:', response)
-                items = response.get('Items', [])
-                user_list = [item['userId'] for item in items]
-                if not user_list:
-                    print(f"{artist} の登録ユーザーは見つかりませんでした")
-                    continue
-
-                # LINE通知をスキップする条件を確認
-                last_notify_table = dynamodb.Table('TicketBotLastNotify')
+                # 通知対象のユーザーを取得し、取得できた分からLINE通知をスキップする条件を確認
                 current_time = int(time.time())
+                cooldown = new_cooldown(artist, current_time)
+                cooldowns.append(cooldown)
+                subscriber_count = 0
                 filtered_user_list = []
-
-                for user_id in user_list:
-                    last_notify_response = last_notify_table.get_item(
-                        Key={
-                            'userId': user_id,
-                            'artist': artist
-                        }
-                    )
-                    last_notify_item = last_notify_response.get('Item')
-                    if last_notify_item:
-                        last_notify_time = last_notify_item.get('EpocTime', 0)
-                        if current_time - last_notify_time < 3600:
+                for user_list in itertools.batched(iter_subscribers(artist), MULTICAST_MAX_RECIPIENTS):
+                    subscriber_count += len(user_list)
+                    eligible_users = cooldown.select(user_list)
+                    for user_id in user_list:
+                        if user_id not in eligible_users:
                             print(f"{user_id} への通知はスキップされました（1時間以内に通知済み）")
                             continue
 
-                    filtered_user_list.append(user_id)
+                        filtered_user_list.append(user_id)
+
+                if not subscriber_count:
+                    print(f"{artist} の登録ユーザーは見つかりませんでした")
+                    continue
 
                 if not filtered_user_list:
                     print(f"{artist} の通知対象ユーザーは全てスキップされました")
                     continue
 
-                headers = {
-                    'Authorization': f'Bearer {token}',
-                    'Content-Type': 'application/json'
-                }
-                body = {
-                    'to': filtered_user_list,
-                    'messages': [
-                        {
-                            'type': 'text',
-                            'text': message
-                        }
-                    ]
-                }
-                response = requests.post(
-                    'https://api.line.me/v2/bot/message/multicast',
-                    headers=headers,
-                    json=body
-                )
-                response.raise_for_status()  # エラー時に例外を投げる
-                print('multicast response:', response.json())
-
-                # 通知後に TicketBotLastNotify を更新
-                for user_id in filtered_user_list:
-                    last_notify_table.put_item(
-                        Item={
-                            'userId': user_id,
-                            'artist': artist,
-                            'EpocTime': current_time
-                        }
-                    )
+                notifications.append({
+                    'artist': artist,
+                    'tickets': artist_available_tickets[artist],
+                    'message': message,
+                    'subscriber_count': subscriber_count,
+                    'users': filtered_user_list,
+                    'cooldown': cooldown
+                })
             else:
                 print(f"{artist} のチケットは見つかりませんでした")
 
+        # 今月の残りの送信数に収まるように通知を選ぶ
+        planned, deferred = plan_notifications(LineClient(token), notifications)
+        for notification in deferred:
+            print(f"{notification['artist']} の通知は送信数の上限のため見送られました:", len(notification['users']))
+            # 見送ったユーザーは次回の実行で通知できるようにする
+            notification['cooldown'].commit([], notification['users'])
+
+        # ユーザーに空き状況を通知
+        failed_artists = {}
+        for notification in planned:
+            artist = notification['artist']
+            cooldown = notification['cooldown']
+
+            # 500件ずつのチャンクに分けて並行して送信する
+            succeeded_user_list, failed_chunks = multicast(
+                token,
+                notification['users'],
+                [
+                    {
+                        'type': 'text',
+                        'text': notification['message']
+                    }
+                ]
+            )
+            consume_quota(len(succeeded_user_list))
+
+            # 送信に成功したユーザーだけが通知済みになるよう TicketBotLastNotify を更新
+            cooldown.commit(
+                succeeded_user_list,
+                [user_id for chunk in failed_chunks for user_id in chunk['to']]
+            )
+            if failed_chunks:
+                failed_artists[artist] = failed_chunks
+
+        # 送信に失敗したチャンクがあれば、他のアーティストの処理を終えてから管理者に通知する
+        if failed_artists:
+            raise RuntimeError('multicast failed: ' + ', '.join(
+                f"{artist} ({sum(len(chunk['to']) for chunk in chunks)} users: {chunks[0]['error']})"
+                for artist, chunks in failed_artists.items()
+            ))
+
     except Exception as e:
         # エラーが発生した場合、管理者に通知
         print('Error:', e)
@@ -175,25 +154,15 @@ def lambda_handler(event, context):
         )
         admin_line_user_id = get_ssm_parameter('TICKET_ADMIN_LINE_USER_ID')
 
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        message = {
-            'to': admin_line_user_id,
-            'messages': [
+        response = LineClient(token).push(
+            admin_line_user_id,
+            [
                 {
                     'type': 'text',
                     'text': f'Error occurred in check_ticket: {str(e)}'
                 }
             ]
-        }
-        response = requests.post(
-            'https://api.line.me/v2/bot/message/push',
-            headers=headers,
-            json=message
         )
-        response.raise_for_status()  # エラー時に例外を投げる
         print('Error notification response:', response.json())
 
         return {
@@ -202,6 +171,14 @@ def lambda_handler(event, context):
             'headers': {'Content-Type': 'application/json'}
         }
 
+    finally:
+        # 例外で送信まで進まなかったユーザーは、次回の実行で通知できるようにする
+        for cooldown in cooldowns:
+            try:
+                cooldown.abort()
+            except Exception as e:
+                print('通知の権利を取り消せませんでした:', cooldown.artist, e)
+
     return {
         'statusCode': 200,
         'body': json.dumps({
@@ -0,0 +1,625 @@
+import itertools
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+from metrics import put_metrics
+from utils import is_conditional_check_failed
+
+
+dynamodb = boto3.resource('dynamodb')
+
+
+# 同じアーティストの通知を再送しない期間（秒）
+COOLDOWN_SECONDS = 3600
+# BatchGetItem 1回あたりの最大キー数
+BATCH_GET_SIZE = 100
+# BatchWriteItem 1回あたりの最大アイテム数
+BATCH_WRITE_SIZE = 25
+# BatchGetItem / BatchWriteItem を並行して実行する数
+COOLDOWN_MAX_WORKERS = int(os.environ.get('COOLDOWN_MAX_WORKERS', '4'))
+# 未処理のキー・アイテムを再試行する最大回数
+COOLDOWN_MAX_RETRIES = int(os.environ.get('COOLDOWN_MAX_RETRIES', '5'))
+# 条件付き書き込みを並行して実行する数
+COOLDOWN_CLAIM_MAX_WORKERS = int(os.environ.get('COOLDOWN_CLAIM_MAX_WORKERS', '16'))
+# 通知の権利（リース）を保持する秒数（check_ticket の実行間隔より短くする）
+COOLDOWN_CLAIM_LEASE_SECONDS = int(os.environ.get('COOLDOWN_CLAIM_LEASE_SECONDS', '120'))
+# 通知済みかどうかの判定方法（claim / batch / artist）
+COOLDOWN_MODE = os.environ.get('COOLDOWN_MODE', 'claim')
+# アーティストごとの通知状態を分割するシャード数
+COOLDOWN_ARTIST_SHARDS = int(os.environ.get('COOLDOWN_ARTIST_SHARDS', '4'))
+# 1シャードのアイテムサイズの上限（DynamoDBの上限400KBに余裕を持たせる）
+COOLDOWN_SHARD_MAX_BYTES = 350 * 1024
+
+LAST_NOTIFY_TABLE = 'TicketBotLastNotify'
+ARTIST_COOLDOWN_TABLE = 'TicketBotArtistCooldown'
+
+
+def _backoff(attempt: int):
+    """指数バックオフ（ジッター付き）で待機する"""
+    time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+
+
+def _batch_get_page(keys: list, table_name: str = LAST_NOTIFY_TABLE, projection: str = 'userId, EpocTime', names: dict = None):
+    """最大100件のキーを BatchGetItem で取得し、未処理のキーは再試行する
+
+    Parameters
+    ----------
+    keys : list[dict]
+        取得するアイテムのキー
+    table_name : str
+        テーブル名
+    projection : str
+        取得する属性
+    names : dict
+        projection で使う属性名のプレースホルダー
+
+    Returns
+    -------
+    list[dict]
+        取得したアイテム
+    """
+    # リソースのクライアントはスレッドセーフで、Pythonの型のまま読み書きできる
+    client = dynamodb.meta.client
+    request = {
+        table_name: {
+            'Keys': keys,
+            'ProjectionExpression': projection
+        }
+    }
+    if names:
+        request[table_name]['ExpressionAttributeNames'] = names
+    items = []
+    for attempt in range(COOLDOWN_MAX_RETRIES + 1):
+        response = client.batch_get_item(RequestItems=request)
+        items.extend(response.get('Responses', {}).get(table_name, []))
+        request = response.get('UnprocessedKeys')
+        if not request:
+            return items
+        _backoff(attempt)
+    raise RuntimeError(f"{table_name} の未処理のキーが残りました: {len(request[table_name]['Keys'])}件")
+
+
+def resolve_cooldown(user_ids: list, artist: str, current_time: int):
+    """前回の通知から COOLDOWN_SECONDS 以上経過しているユーザーを取得する
+
+    TicketBotLastNotify を100件ずつの BatchGetItem で並行して取得する。
+
+    Parameters
+    ----------
+    user_ids : list[str]
+        通知対象のユーザーID
+    artist : str
+        アーティスト名
+    current_time : int
+        現在時刻（エポック秒）
+
+    Returns
+    -------
+    set[str]
+        通知してよいユーザーID
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    pages = [
+        [{'userId': user_id, 'artist': artist} for user_id in page]
+        for page in itertools.batched(user_ids, BATCH_GET_SIZE)
+    ]
+    recently_notified = set()
+    with ThreadPoolExecutor(max_workers=COOLDOWN_MAX_WORKERS) as executor:
+        for items in executor.map(_batch_get_page, pages):
+            for item in items:
+                if current_time - item.get('EpocTime', 0) < COOLDOWN_SECONDS:
+                    recently_notified.add(item['userId'])
+    return set(user_ids) - recently_notified
+
+
+def _batch_write_page(items: list):
+    """最大25件のアイテムを BatchWriteItem で書き込み、未処理のアイテムは再試行する
+
+    Parameters
+    ----------
+    items : list[dict]
+        TicketBotLastNotify のアイテム
+
+    Returns
+    -------
+    float
+        消費した書き込みキャパシティユニット
+    """
+    client = dynamodb.meta.client
+    request = {
+        LAST_NOTIFY_TABLE: [{'PutRequest': {'Item': item}} for item in items]
+    }
+    consumed = 0.0
+    for attempt in range(COOLDOWN_MAX_RETRIES + 1):
+        response = client.batch_write_item(RequestItems=request, ReturnConsumedCapacity='TOTAL')
+        consumed += sum(c.get('CapacityUnits', 0) for c in response.get('ConsumedCapacity', []))
+        request = response.get('UnprocessedItems')
+        if not request:
+            return consumed
+        _backoff(attempt)
+    raise RuntimeError(f"{LAST_NOTIFY_TABLE} の未処理のアイテムが残りました: {len(request[LAST_NOTIFY_TABLE])}件")
+
+
+def record_notified(user_ids: list, artist: str, current_time: int):
+    """通知したユーザーの通知時刻を TicketBotLastNotify に記録する
+
+    25件ずつの BatchWriteItem を並行して実行し、
+    消費した書き込みキャパシティユニットをメトリクスとして出力する。
+
+    Parameters
+    ----------
+    user_ids : list[str]
+        通知したユーザーID
+    artist : str
+        アーティスト名
+    current_time : int
+        通知時刻（エポック秒）
+
+    Returns
+    -------
+    float
+        消費した書き込みキャパシティユニットの合計
+    """
+    items = [
+        {'userId': user_id, 'artist': artist, 'EpocTime': current_time, 'ExpiresAt': current_time + COOLDOWN_SECONDS}
+        for user_id in dict.fromkeys(user_ids)
+    ]
+    pages = list(itertools.batched(items, BATCH_WRITE_SIZE))
+    with ThreadPoolExecutor(max_workers=COOLDOWN_MAX_WORKERS) as executor:
+        consumed = list(executor.map(_batch_write_page, pages))
+    print(f"{LAST_NOTIFY_TABLE} consumed capacity:", {'items': len(items), 'batches': consumed, 'total': sum(consumed)})
+    put_metrics(
+        {
+            'LastNotifyWriteItems': len(items),
+            'LastNotifyWriteBatches': len(pages),
+            'LastNotifyConsumedWriteCapacity': sum(consumed)
+        },
+        dimensions={'Artist': artist}
+    )
+    return sum(consumed)
+
+
+class BatchCooldown:
+    """BatchGetItem で通知済みかを確認し、送信後に BatchWriteItem で記録する"""
+
+    def __init__(self, artist: str, current_time: int):
+        """
+        Parameters
+        ----------
+        artist : str
+            アーティスト名
+        current_time : int
+            現在時刻（エポック秒）
+        """
+        self.artist = artist
+        self.current_time = current_time
+
+    def select(self, user_ids: list):
+        """通知してよいユーザーを取得する
+
+        Parameters
+        ----------
+        user_ids : list[str]
+            通知対象のユーザーID
+
+        Returns
+        -------
+        set[str]
+            通知してよいユーザーID
+        """
+        return resolve_cooldown(user_ids, self.artist, self.current_time)
+
+    def commit(self, succeeded: list, failed: list):
+        """送信結果を記録する
+
+        Parameters
+        ----------
+        succeeded : list[str]
+            送信に成功したユーザーID
+        failed : list[str]
+            送信に失敗したユーザーID
+        """
+        if succeeded:
+            record_notified(succeeded, self.artist, self.current_time)
+
+    def abort(self):
+        """送信後にだけ記録するため、取り消すものはない"""
+        return None
+
+
+class ClaimCooldown:
+    """条件付き UpdateItem で通知の権利を短いリースとして確保し、送信後に確定する
+
+    前回の通知から COOLDOWN_SECONDS 以上経過していて（または未通知で）、
+    他の実行がリースを保持していない場合だけ ClaimedBy と ClaimedUntil を書き込める。
+    確保できたユーザーにだけ送信すればよく、同時に実行された check_ticket が
+    同じユーザーに重複して送信することもない。
+    EpocTime は送信に成功したユーザーだけ commit で更新する。
+    送信前に例外やタイムアウトで終了しても、リースは COOLDOWN_CLAIM_LEASE_SECONDS 秒で失効し、
+    次回の実行で再び通知できる。
+    ExpiresAt はTTL属性として使い、古いアイテムは自動的に削除される。
+    リース中にTTLで行ごと削除されないよう、確保する際に ExpiresAt をリースの期限に延ばす。
+    """
+
+    def __init__(self, artist: str, current_time: int):
+        """
+        Parameters
+        ----------
+        artist : str
+            アーティスト名
+        current_time : int
+            現在時刻（エポック秒）
+        """
+        self.artist = artist
+        self.current_time = current_time
+        self.owner = str(uuid.uuid4())
+        # 確保したまま、まだ確定も取り消しもしていないユーザーID
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _claim(self, user_id: str):
+        """1ユーザー分の通知の権利をリースとして確保する
+
+        Returns
+        -------
+        bool
+            確保できたかどうか
+        """
+        try:
+            dynamodb.meta.client.update_item(
+                TableName=LAST_NOTIFY_TABLE,
+                Key={'userId': user_id, 'artist': self.artist},
+                UpdateExpression='SET ClaimedBy = :owner, ClaimedUntil = :lease_until, ExpiresAt = :lease_until',
+                ConditionExpression='(attribute_not_exists(EpocTime) OR EpocTime <= :threshold)'
+                                    ' AND (attribute_not_exists(ClaimedUntil) OR ClaimedUntil < :now)',
+                ExpressionAttributeValues={
+                    ':owner': self.owner,
+                    ':lease_until': self.current_time + COOLDOWN_CLAIM_LEASE_SECONDS,
+                    ':now': self.current_time,
+                    ':threshold': self.current_time - COOLDOWN_SECONDS
+                }
+            )
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            raise
+        return True
+
+    def select(self, user_ids: list):
+        """通知の権利を確保できたユーザーを取得する
+
+        Parameters
+        ----------
+        user_ids : list[str]
+            通知対象のユーザーID
+
+        Returns
+        -------
+        set[str]
+            通知の権利を確保できたユーザーID
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        claimed = set()
+        with ThreadPoolExecutor(max_workers=COOLDOWN_CLAIM_MAX_WORKERS) as executor:
+            for user_id, ok in zip(user_ids, executor.map(self._claim, user_ids)):
+                if ok:
+                    claimed.add(user_id)
+        with self._lock:
+            self._pending |= claimed
+        return claimed
+
+    def _confirm(self, user_id: str):
+        """送信に成功したユーザーの EpocTime を更新し、リースを外す"""
+        dynamodb.meta.client.update_item(
+            TableName=LAST_NOTIFY_TABLE,
+            Key={'userId': user_id, 'artist': self.artist},
+            UpdateExpression='SET EpocTime = :now, ExpiresAt = :expires_at REMOVE ClaimedBy, ClaimedUntil',
+            ExpressionAttributeValues={
+                ':now': self.current_time,
+                ':expires_at': self.current_time + COOLDOWN_SECONDS
+            }
+        )
+
+    def _release(self, user_id: str):
+        """送信しなかったユーザーのリースを外す"""
+        try:
+            dynamodb.meta.client.update_item(
+                TableName=LAST_NOTIFY_TABLE,
+                Key={'userId': user_id, 'artist': self.artist},
+                UpdateExpression='REMOVE ClaimedBy, ClaimedUntil',
+                ConditionExpression='ClaimedBy = :owner',
+                ExpressionAttributeValues={':owner': self.owner}
+            )
+        except ClientError as e:
+            # リースが失効して別の実行が確保している場合はそのままにする
+            if not is_conditional_check_failed(e):
+                raise
+
+    def _settle(self, confirmed: list, released: list):
+        with self._lock:
+            self._pending -= set(confirmed) | set(released)
+        with ThreadPoolExecutor(max_workers=COOLDOWN_CLAIM_MAX_WORKERS) as executor:
+            list(executor.map(self._confirm, confirmed))
+            list(executor.map(self._release, released))
+
+    def commit(self, succeeded: list, failed: list):
+        """送信結果を記録する
+
+        送信に成功したユーザーは EpocTime を更新して確定し、
+        失敗したユーザーはリースを外して次回の実行で再送できるようにする。
+
+        Parameters
+        ----------
+        succeeded : list[str]
+            送信に成功したユーザーID
+        failed : list[str]
+            送信に失敗したユーザーID
+        """
+        self._settle(list(succeeded), list(failed))
+
+    def abort(self):
+        """確定も取り消しもしていないリースをすべて外す
+
+        送信の途中で例外が発生した場合に呼び出す。
+        """
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            print(f"{self.artist} の未送信の確保を取り消します:", len(pending))
+            self._settle([], pending)
+
+
+def _shard_of(user_id: str, shards: int):
+    """ユーザーIDが属するシャード番号を取得する"""
+    return zlib.crc32(user_id.encode('utf-8')) % shards
+
+
+def _entry_size(user_id: str, epoch):
+    """notified マップの1要素のサイズ（バイト）を見積もる"""
+    return len(user_id.encode('utf-8')) + (len(str(int(epoch))) + 1) // 2 + 1 + 1
+
+
+def estimate_shard_size(artist: str, notified: dict):
+    """シャードのアイテムサイズ（バイト）を見積もる
+
+    DynamoDBのアイテムサイズの計算方法に従い、属性名とキーの長さ、
+    数値のサイズ（有効桁数2桁ごとに1バイト + 1バイト）、
+    マップの要素ごとのオーバーヘッド（1バイト）を合計する。
+
+    Parameters
+    ----------
+    artist : str
+        アーティスト名
+    notified : dict
+        ユーザーIDと通知時刻のマッピング
+
+    Returns
+    -------
+    int
+        アイテムサイズの見積もり
+    """
+    size = len('artist') + len(artist.encode('utf-8')) + len('shard') + 2 + len('version') + 4 + len('notified') + 3 + len('ExpiresAt') + 6
+    for user_id, epoch in notified.items():
+        size += _entry_size(user_id, epoch)
+    return size
+
+
+class ArtistCooldown:
+    """アーティストごとに通知状態をまとめたアイテムで通知済みかを判定する
+
+    TicketBotArtistCooldown に、アーティスト(artist)とシャード番号(shard)ごとに
+    直近 COOLDOWN_SECONDS 以内に通知したユーザーIDと通知時刻のマップ(notified)を持つ。
+    登録ユーザー数に関係なく、判定はシャード数分の読み込み（BatchGetItem 1回）で済む。
+
+    1シャードに入るのは約8,900ユーザー（LINEのユーザーIDは33文字、上限 COOLDOWN_SHARD_MAX_BYTES）で、
+    select の時点でシャードの空きを確認し、記録できないユーザーは送信対象にしない
+    （送信後に記録できずに毎回再送することを防ぐ）。
+    その場合は ArtistCooldownShardFull メトリクスを出力するため、
+    COOLDOWN_ARTIST_SHARDS を増やす必要がある。
+    シャード数を変更すると、変更前に記録した通知状態は参照されなくなる。
+    """
+
+    def __init__(self, artist: str, current_time: int, shards: int = COOLDOWN_ARTIST_SHARDS):
+        """
+        Parameters
+        ----------
+        artist : str
+            アーティスト名
+        current_time : int
+            現在時刻（エポック秒）
+        shards : int
+            シャード数
+        """
+        self.artist = artist
+        self.current_time = current_time
+        self.shards = shards
+        # シャード番号と、通知状態(notified)・バージョン(version)のマッピング
+        self._state = None
+        # シャード番号と、select で確保した分を含むアイテムサイズの見積もりのマッピング
+        self._sizes = None
+
+    def _load(self):
+        """すべてのシャードを読み込む"""
+        keys = [{'artist': self.artist, 'shard': shard} for shard in range(self.shards)]
+        self._state = {shard: {'notified': {}, 'version': None} for shard in range(self.shards)}
+        for page in itertools.batched(keys, BATCH_GET_SIZE):
+            for item in _batch_get_page(
+                list(page),
+                ARTIST_COOLDOWN_TABLE,
+                '#shard, notified, #version',
+                {'#shard': 'shard', '#version': 'version'}
+            ):
+                self._state[int(item['shard'])] = {
+                    'notified': item.get('notified', {}),
+                    'version': item.get('version')
+                }
+        self._sizes = {
+            shard: estimate_shard_size(self.artist, self._live(state['notified']))
+            for shard, state in self._state.items()
+        }
+
+    def _live(self, notified: dict):
+        """通知から COOLDOWN_SECONDS 以内のユーザーだけを取り出す"""
+        return {
+            user_id: epoch for user_id, epoch in notified.items()
+            if self.current_time - epoch < COOLDOWN_SECONDS
+        }
+
+    def _reload(self, shard: int):
+        """1シャードを強い整合性で読み込み直す"""
+        response = dynamodb.meta.client.get_item(
+            TableName=ARTIST_COOLDOWN_TABLE,
+            Key={'artist': self.artist, 'shard': shard},
+            ConsistentRead=True
+        )
+        item = response.get('Item', {})
+        self._state[shard] = {
+            'notified': item.get('notified', {}),
+            'version': item.get('version')
+        }
+
+    def select(self, user_ids: list):
+        """通知してよいユーザーを取得する
+
+        Parameters
+        ----------
+        user_ids : list[str]
+            通知対象のユーザーID
+
+        Returns
+        -------
+        set[str]
+            通知してよいユーザーID
+        """
+        if self._state is None:
+            self._load()
+        eligible = set()
+        full = 0
+        for user_id in dict.fromkeys(user_ids):
+            shard = _shard_of(user_id, self.shards)
+            notified = self._state[shard]['notified']
+            if self.current_time - notified.get(user_id, 0) < COOLDOWN_SECONDS:
+                continue
+            # 送信後に記録できないユーザーには送信しない
+            size = _entry_size(user_id, self.current_time)
+            if self._sizes[shard] + size > COOLDOWN_SHARD_MAX_BYTES:
+                full += 1
+                continue
+            self._sizes[shard] += size
+            eligible.add(user_id)
+        if full:
+            print(f"{ARTIST_COOLDOWN_TABLE} のシャードに空きがないため、{full} ユーザーへの通知を見送りました。COOLDOWN_ARTIST_SHARDS を増やしてください")
+            put_metrics({'ArtistCooldownShardFull': full}, dimensions={'Artist': self.artist})
+        return eligible
+
+    def _write_shard(self, shard: int, user_ids: list):
+        """1シャードに通知したユーザーを記録する
+
+        期限切れのユーザーを取り除いてから追加し、
+        バージョンによる楽観的ロックで他の実行との競合を防ぐ。
+        """
+        for attempt in range(COOLDOWN_MAX_RETRIES + 1):
+            state = self._state[shard]
+            notified = self._live(state['notified'])
+            notified.update((user_id, self.current_time) for user_id in user_ids)
+            size = estimate_shard_size(self.artist, notified)
+            if size > COOLDOWN_SHARD_MAX_BYTES:
+                # 同時に実行された他の check_ticket の記録と合わせて上限を超えた場合。
+                # 送信済みのユーザーを記録できずに毎回再送しないよう、古い記録から捨てる
+                print(f"{ARTIST_COOLDOWN_TABLE} のシャードが上限を超えるため、古い記録を削除します（{self.artist} / {shard}: {size} bytes）")
+                for user_id in sorted(notified, key=notified.get):
+                    if size <= COOLDOWN_SHARD_MAX_BYTES:
+                        break
+                    size -= _entry_size(user_id, notified.pop(user_id))
+            version = state['version']
+            item = {
+                'artist': self.artist,
+                'shard': shard,
+                'notified': notified,
+                'version': (version or 0) + 1,
+                'ExpiresAt': self.current_time + COOLDOWN_SECONDS
+            }
+            try:
+                if version is None:
+                    dynamodb.meta.client.put_item(
+                        TableName=ARTIST_COOLDOWN_TABLE,
+                        Item=item,
+                        ConditionExpression='attribute_not_exists(artist)'
+                    )
+                else:
+                    dynamodb.meta.client.put_item(
+                        TableName=ARTIST_COOLDOWN_TABLE,
+                        Item=item,
+                        ConditionExpression='#version = :version',
+                        ExpressionAttributeNames={'#version': 'version'},
+                        ExpressionAttributeValues={':version': version}
+                    )
+            except ClientError as e:
+                if not is_conditional_check_failed(e):
+                    raise
+                # 他の実行が先に更新したため、読み込み直して再試行する
+                self._reload(shard)
+                _backoff(attempt)
+                continue
+            self._state[shard] = {'notified': notified, 'version': item['version']}
+            return
+        raise RuntimeError(f"{ARTIST_COOLDOWN_TABLE} の更新が競合しました（{self.artist} / {shard}）")
+
+    def commit(self, succeeded: list, failed: list):
+        """送信結果を記録する
+
+        Parameters
+        ----------
+        succeeded : list[str]
+            送信に成功したユーザーID
+        failed : list[str]
+            送信に失敗したユーザーID
+        """
+        if self._state is None:
+            self._load()
+        by_shard = {}
+        for user_id in succeeded:
+            by_shard.setdefault(_shard_of(user_id, self.shards), []).append(user_id)
+        with ThreadPoolExecutor(max_workers=COOLDOWN_MAX_WORKERS) as executor:
+            list(executor.map(lambda args: self._write_shard(*args), by_shard.items()))
+
+    def abort(self):
+        """送信後にだけ記録するため、取り消すものはない"""
+        return None
+
+
+# 判定方法の名前とクラスのマッピング
+cooldowns = {
+    'batch': BatchCooldown,
+    'claim': ClaimCooldown,
+    'artist': ArtistCooldown,
+}
+
+
+def new_cooldown(artist: str, current_time: int, mode: str = COOLDOWN_MODE):
+    """環境変数で指定された方法で通知済みかを判定するオブジェクトを生成する
+
+    Parameters
+    ----------
+    artist : str
+        アーティスト名
+    current_time : int
+        現在時刻（エポック秒）
+    mode : str
+        判定方法（claim / batch / artist）
+
+    Returns
+    -------
+    BatchCooldown or ClaimCooldown or ArtistCooldown
+        通知済みかを判定するオブジェクト
+    """
+    return cooldowns.get(mode, ClaimCooldown)(artist, current_time)
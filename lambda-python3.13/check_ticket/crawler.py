@@ -0,0 +1,208 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+from extractors import Extractor, build_extractor, iter_performs, may_have_buy_button
+from http_session import decode_content, decode_counter, response_encoding, session
+from page_cache import PageCache, body_digest
+from utils import base_url
+
+
+# クローラー全体の同時実行数
+CRAWL_MAX_WORKERS = int(os.environ.get('CRAWL_MAX_WORKERS', '8'))
+# 同一ホストへの同時リクエスト数の上限
+CRAWL_MAX_PER_HOST = int(os.environ.get('CRAWL_MAX_PER_HOST', '4'))
+# イベントページをダウンロードしながら解析するかどうか
+CRAWL_STREAMING = os.environ.get('CRAWL_STREAMING', 'false').lower() == 'true'
+# ストリーミング時に読み込むチャンクのサイズ（バイト）
+CRAWL_CHUNK_SIZE = int(os.environ.get('CRAWL_CHUNK_SIZE', '16384'))
+# ストリーミング時に、これが閉じたら読み込みをやめる要素のタグ名（空の場合は最後まで読む）
+CRAWL_STREAM_END_TAG = os.environ.get('CRAWL_STREAM_END_TAG', '')
+
+
+class Crawler:
+    """アーティストページとイベントページを並行して取得するクローラー
+
+    アーティストページは並行して取得し、イベントページへのリンクを解析でき次第、
+    そのアーティストのイベントページの取得を開始する。
+    同一ホストへの同時リクエスト数はホストごとのセマフォで制限する。
+    """
+
+    def __init__(self, max_workers: int = CRAWL_MAX_WORKERS, max_per_host: int = CRAWL_MAX_PER_HOST, cache: PageCache = None, extractor: Extractor = None, streaming: bool = CRAWL_STREAMING):
+        """
+        Parameters
+        ----------
+        max_workers : int
+            スレッドプールのワーカー数
+        max_per_host : int
+            同一ホストへの同時リクエスト数の上限
+        cache : PageCache
+            条件付きGETに使うキャッシュ
+        extractor : Extractor
+            ページから情報を取り出す抽出クラス（省略時は環境変数で選択）
+        streaming : bool
+            イベントページをダウンロードしながら解析するかどうか
+        """
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.cache = cache if cache is not None else PageCache()
+        self.extractor = extractor if extractor is not None else build_extractor()
+        self.streaming = streaming
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str):
+        """URLのホストに対応するセマフォを取得する"""
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def fetch(self, url: str, parser, precheck=None):
+        """ホストごとの同時リクエスト数を守ってページを取得し、解析する
+
+        前回の検証子で条件付きGETを行い、304が返ってきた場合か、
+        レスポンスボディのハッシュが前回と一致した場合は
+        キャッシュされた解析結果を再利用する。
+
+        Parameters
+        ----------
+        url : str
+            取得するページのURL
+        parser : Callable[[str], any]
+            レスポンスボディを解析する関数
+        precheck : Callable[[bytes, str], bool]
+            レスポンスボディのバイト列とエンコーディングを解析の前に調べる関数。
+            False を返した場合は解析せずに空の結果を返す。
+
+        Returns
+        -------
+        any
+            解析結果
+        """
+        headers = self.cache.conditional_headers(url)
+        with self._host_semaphore(url):
+            res = session.get(url, headers=headers)
+        if res.status_code == 304:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached
+            # キャッシュが消えている場合は検証子なしで取り直す
+            with self._host_semaphore(url):
+                res = session.get(url)
+        if res.status_code != 200:
+            return parser(decode_content(res))
+        if precheck is not None and not precheck(res.content, response_encoding(res)):
+            result = []
+            self.cache.put(url, res.headers, None, result)
+            return result
+        # 検証子に対応していないサーバーでも、ボディが前回と同じなら解析をスキップする
+        digest = body_digest(res.content)
+        result = self.cache.get_by_body(url, digest)
+        if result is None:
+            result = parser(decode_content(res))
+        self.cache.put(url, res.headers, digest, result)
+        return result
+
+    def fetch_stream(self, url: str):
+        """イベントページをダウンロードしながら公演情報を取り出す
+
+        DOMを構築せずに perform-list を逐次取り出すため、メモリ使用量が抑えられる。
+        CRAWL_STREAM_END_TAG を指定した場合はその要素が閉じた時点で読み込みをやめる。
+        途中で読み込みをやめたコネクションはプールに戻らない。
+        HTML_PARSER_BACKEND と「購入手続きへ」ボタンの事前チェックは使わないため、
+        有効にする前に HTML_SHADOW_BACKEND=stream で結果が一致することを確認する。
+
+        Parameters
+        ----------
+        url : str
+            取得するイベントページのURL
+
+        Returns
+        -------
+        list[dict]
+            公演情報
+        """
+        headers = self.cache.conditional_headers(url)
+        with self._host_semaphore(url):
+            res = session.get(url, headers=headers, stream=True)
+            try:
+                if res.status_code == 304:
+                    cached = self.cache.get(url)
+                    if cached is not None:
+                        return cached
+                    # キャッシュが消えている場合は検証子なしで取り直す
+                    res.close()
+                    res = session.get(url, stream=True)
+                result = list(iter_performs(res.iter_content(CRAWL_CHUNK_SIZE), response_encoding(res), CRAWL_STREAM_END_TAG))
+            finally:
+                res.close()
+        if res.status_code == 200:
+            # ボディ全体を読まないため、ハッシュは保存しない
+            self.cache.put(url, res.headers, None, result)
+        return result
+
+    def _crawl_event(self, event_url: str):
+        """イベントページを取得して公演情報を返す"""
+        if self.streaming:
+            return self.fetch_stream(f"{base_url}/{event_url}")
+        # 「購入手続きへ」ボタンがないページは空きがないため、解析をスキップする
+        return self.fetch(f"{base_url}/{event_url}", self.extractor.performs, precheck=may_have_buy_button)
+
+    def _crawl_artist(self, executor: ThreadPoolExecutor, artist_id: int):
+        """アーティストページを取得し、イベントページの取得をスケジュールする
+
+        Returns
+        -------
+        list[tuple[str, Future]]
+            イベントページのURLと公演情報を返すFutureの組
+        """
+        artist_page_url = f"{base_url}/events/artist/{artist_id}"
+        event_urls = self.fetch(artist_page_url, self.extractor.event_links)
+        return [
+            (event_url, executor.submit(self._crawl_event, event_url))
+            for event_url in event_urls
+        ]
+
+    def crawl(self, artists: dict):
+        """すべてのアーティストの空き状況を取得する
+
+        Parameters
+        ----------
+        artists : dict
+            アーティスト名とURLに含まれるIDのマッピング
+
+        Returns
+        -------
+        dict[str, list[dict]]
+            アーティスト名ごとの空きのある公演の日時(date)、会場(place)、URL(url)
+        """
+        artist_available_tickets = {}
+        self.cache.load()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            artist_futures = [
+                (artist_name, executor.submit(self._crawl_artist, executor, artist_id))
+                for artist_name, artist_id in artists.items()
+            ]
+            # 結果はアーティスト・イベント・公演の順序を保って集計する
+            for artist_name, artist_future in artist_futures:
+                artist_available_tickets[artist_name] = []
+                for event_url, event_future in artist_future.result():
+                    for perform in event_future.result():
+                        # 「購入手続きへ」ボタンが存在する場合、日時と会場とURLを追加
+                        if perform['available']:
+                            print('空きあり', artist_name, perform['date'], perform['place'], f"{base_url}/{event_url}")
+                            artist_available_tickets[artist_name].append({
+                                'date': perform['date'],
+                                'place': perform['place'],
+                                'url': f"{base_url}/{event_url}"
+                            })
+        # 最後まで取得できた場合のみ、参照しなくなったURLを削除して保存する
+        self.cache.save()
+        print('decode counter:', dict(decode_counter))
+        return artist_available_tickets
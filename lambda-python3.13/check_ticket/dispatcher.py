@@ -0,0 +1,71 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+from line_client import LineClient
+
+
+# multicast 1回あたりの最大送信先数（LINE Messaging APIの上限）
+MULTICAST_MAX_RECIPIENTS = 500
+# multicast を並行して送信する数
+MULTICAST_MAX_WORKERS = int(os.environ.get('MULTICAST_MAX_WORKERS', '4'))
+# 失敗したチャンクを含めた最大送信回数
+MULTICAST_MAX_ATTEMPTS = int(os.environ.get('MULTICAST_MAX_ATTEMPTS', '2'))
+
+
+def _send_chunk(client: LineClient, chunk: dict, messages: list):
+    """1チャンク分の multicast を送信する
+
+    Returns
+    -------
+    dict
+        送信先(to)、X-Line-Retry-Key(retry_key)、成否(ok)、エラー内容(error)
+    """
+    try:
+        client.multicast(chunk['to'], messages, retry_key=chunk['retry_key'])
+        return {**chunk, 'ok': True, 'error': None}
+    except Exception as e:
+        # 1つのチャンクの失敗で、送信済みのチャンクの結果を失わないようにする
+        return {**chunk, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+
+def multicast(token: str, user_ids: list, messages: list):
+    """送信先を500件ずつのチャンクに分けて multicast を並行して送信する
+
+    失敗したチャンクだけを MULTICAST_MAX_ATTEMPTS 回まで再送する。
+    チャンクごとの X-Line-Retry-Key は再送しても変えないため、
+    実際には届いていたチャンクが重複して送信されることはない。
+
+    Parameters
+    ----------
+    token : str
+        アクセストークン
+    user_ids : list[str]
+        送信先のユーザーID
+    messages : list[dict]
+        送信するメッセージ
+
+    Returns
+    -------
+    tuple[list[str], list[dict]]
+        送信に成功したユーザーIDと、最終的に失敗したチャンクの送信結果
+    """
+    client = LineClient(token)
+    pending = [
+        {'to': user_ids[i:i + MULTICAST_MAX_RECIPIENTS], 'retry_key': str(uuid.uuid4())}
+        for i in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS)
+    ]
+    succeeded = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=MULTICAST_MAX_WORKERS) as executor:
+        for attempt in range(MULTICAST_MAX_ATTEMPTS):
+            results = list(executor.map(lambda chunk: _send_chunk(client, chunk, messages), pending))
+            for result in results:
+                print('multicast chunk:', {'attempt': attempt + 1, 'recipients': len(result['to']), 'ok': result['ok'], 'error': result['error']})
+            succeeded.extend(user_id for result in results if result['ok'] for user_id in result['to'])
+            failed = [result for result in results if not result['ok']]
+            pending = [{'to': result['to'], 'retry_key': result['retry_key']} for result in failed]
+            if not pending:
+                break
+    return succeeded, failed
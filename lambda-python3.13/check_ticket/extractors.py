@@ -0,0 +1,633 @@
+import codecs
+import html as html_lib
+import os
+import re
+import time
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+from metrics import put_metrics
+
+
+# 使用するHTMLパーサーのバックエンド（html.parser / lxml / selectolax / regex / stream）
+HTML_PARSER_BACKEND = os.environ.get('HTML_PARSER_BACKEND', 'html.parser')
+# シャドー実行で比較するバックエンド（空の場合は比較しない）
+HTML_SHADOW_BACKEND = os.environ.get('HTML_SHADOW_BACKEND', '')
+# BeautifulSoupで必要な部分木だけを構築するかどうか
+HTML_RESTRICTED_PARSE = os.environ.get('HTML_RESTRICTED_PARSE', 'true').lower() == 'true'
+# 「購入手続きへ」ボタンの有無を判定するための文字列（ページのエンコーディングで検索する）
+BUY_BUTTON_MARKER = os.environ.get('BUY_BUTTON_MARKER', '購入手続きへ')
+
+
+class Extractor:
+    """アーティストページとイベントページから必要な情報を取り出すインターフェース
+
+    バックエンドごとにこのクラスを継承し、同じ構造の結果を返す。
+    """
+
+    name = None
+
+    def event_links(self, html: str):
+        """アーティストページからイベントページへのリンクを取得する
+
+        Parameters
+        ----------
+        html : str
+            アーティストページのHTML
+
+        Returns
+        -------
+        list[str]
+            イベントページのURL（サイトルートからの相対パス）
+        """
+        raise NotImplementedError
+
+    def performs(self, html: str):
+        """イベントページから公演情報を取得する
+
+        Parameters
+        ----------
+        html : str
+            イベントページのHTML
+
+        Returns
+        -------
+        list[dict]
+            公演ごとの日時(date)、会場(place)、「購入手続きへ」ボタンの有無(available)
+        """
+        raise NotImplementedError
+
+
+def _has_class(name: str):
+    """class属性に指定したクラスを含むかを判定する SoupStrainer 用の関数
+
+    SoupStrainer には class属性が分割前の文字列のまま渡されることがあるため、
+    空白で分割してから判定する。
+    """
+    def match(value):
+        if not value:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return name in value
+    return match
+
+
+class SoupExtractor(Extractor):
+    """BeautifulSoup（html.parser）による抽出
+
+    restricted を指定すると SoupStrainer で参照する要素の部分木だけを構築し、
+    解析時間とメモリ使用量を抑える。
+    """
+
+    name = 'html.parser'
+
+    def __init__(self, restricted: bool = HTML_RESTRICTED_PARSE):
+        """
+        Parameters
+        ----------
+        restricted : bool
+            a.d-block と div.perform-list の部分木だけを構築するかどうか
+        """
+        self.restricted = restricted
+        self._event_links_only = SoupStrainer('a', { 'class': _has_class('d-block') }) if restricted else None
+        self._performs_only = SoupStrainer('div', { 'class': _has_class('perform-list') }) if restricted else None
+
+    def event_links(self, html: str):
+        soup = BeautifulSoup(html, 'html.parser', parse_only=self._event_links_only)
+        links = []
+        for event in soup.find_all('a', { 'class': 'd-block' }):
+            event_url = event.get('href')
+            if event_url:
+                links.append(event_url)
+        return links
+
+    def performs(self, html: str):
+        soup = BeautifulSoup(html, 'html.parser', parse_only=self._performs_only)
+        performs = []
+        # perform-listをすべて取得
+        for perform in soup.find_all('div', { 'class': 'perform-list' }):
+            performs.append({
+                # 日時
+                'date': perform.find('div', { 'class': 'lead' }).text,
+                # 会場
+                'place': perform.find('p').text,
+                # 「購入手続きへ」ボタン（ない場合もある）
+                'available': perform.find('button', { 'class': 'btn' }) is not None
+            })
+        return performs
+
+
+def _xpath_class(name: str):
+    """class属性に指定したクラスを含む要素を選ぶXPathの条件式"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class LxmlExtractor(Extractor):
+    """lxml（libxml2）による抽出"""
+
+    name = 'lxml'
+
+    def __init__(self):
+        import lxml.html
+        self._fromstring = lxml.html.fromstring
+
+    def _parse(self, html: str):
+        # 空のドキュメントは lxml が例外を投げるため、空の要素として扱う
+        return self._fromstring(html or '<html></html>')
+
+    def event_links(self, html: str):
+        links = []
+        for event in self._parse(html).xpath(f"//a[{_xpath_class('d-block')}]"):
+            event_url = event.get('href')
+            if event_url:
+                links.append(event_url)
+        return links
+
+    def performs(self, html: str):
+        performs = []
+        for perform in self._parse(html).xpath(f"//div[{_xpath_class('perform-list')}]"):
+            performs.append({
+                'date': perform.xpath(f".//div[{_xpath_class('lead')}]")[0].text_content(),
+                'place': perform.xpath('.//p')[0].text_content(),
+                'available': bool(perform.xpath(f".//button[{_xpath_class('btn')}]"))
+            })
+        return performs
+
+
+class SelectolaxExtractor(Extractor):
+    """selectolax（lexbor）による抽出"""
+
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def event_links(self, html: str):
+        links = []
+        for event in self._parser(html).css('a.d-block'):
+            event_url = event.attributes.get('href')
+            if event_url:
+                links.append(event_url)
+        return links
+
+    def performs(self, html: str):
+        performs = []
+        for perform in self._parser(html).css('div.perform-list'):
+            performs.append({
+                'date': perform.css_first('div.lead').text(),
+                'place': perform.css_first('p').text(),
+                'available': perform.css_first('button.btn') is not None
+            })
+        return performs
+
+
+# タグ（コメントを含む）と属性を取り出す正規表現
+_TAG_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.S)
+_ATTR_RE = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+_STRIP_TAGS_RE = re.compile(r'<[^>]*>')
+# 中身をタグとして解釈しない要素（script / style / textarea）の終了タグ
+_RAW_TEXT_END_RES = {
+    tag: re.compile(rf'</{tag}\s*>', re.I)
+    for tag in ('script', 'style', 'textarea')
+}
+
+
+def _iter_tags(html: str):
+    """タグ（コメントを含む）を先頭から順に取り出す
+
+    ブラウザや html.parser と同じく、script / style / textarea の中身はタグとして扱わず、
+    終了タグまで読み飛ばす。
+    """
+    pos = 0
+    while True:
+        m = _TAG_RE.search(html, pos)
+        if m is None:
+            return
+        yield m
+        pos = m.end()
+        tag = (m.group(2) or '').lower()
+        if not m.group(1) and tag in _RAW_TEXT_END_RES:
+            end = _RAW_TEXT_END_RES[tag].search(html, pos)
+            if end is None:
+                return
+            pos = end.start()
+
+
+def _attrs(source: str):
+    """タグの属性部分を辞書に変換する"""
+    attrs = {}
+    for m in _ATTR_RE.finditer(source):
+        name = m.group(1).lower()
+        if name in attrs:
+            continue
+        value = next((v for v in m.group(2, 3, 4) if v is not None), '')
+        attrs[name] = html_lib.unescape(value)
+    return attrs
+
+
+def _classes(source: str):
+    """タグの属性部分からclassの一覧を取得する"""
+    return _attrs(source).get('class', '').split()
+
+
+def _text(fragment: str):
+    """HTML断片からタグとコメントを除いたテキストを取得する"""
+    return html_lib.unescape(_STRIP_TAGS_RE.sub('', _COMMENT_RE.sub('', fragment)))
+
+
+class RegexExtractor(Extractor):
+    """DOMを構築せず、タグを1回走査するだけで抽出する
+
+    参照する構造（a.d-block の href と、div.perform-list 内の
+    div.lead・p・button.btn）に限定して、コンパイル済みの正規表現でタグを読み進める。
+    """
+
+    name = 'regex'
+
+    def event_links(self, html: str):
+        links = []
+        for m in _iter_tags(html):
+            if m.group(1) != '' or (m.group(2) or '').lower() != 'a':
+                continue
+            attrs = _attrs(m.group(3))
+            if 'd-block' in attrs.get('class', '').split() and attrs.get('href'):
+                links.append(attrs['href'])
+        return links
+
+    def performs(self, html: str):
+        performs = []
+        perform = None
+        for m in _iter_tags(html):
+            closing, tag, source = m.group(1), m.group(2), m.group(3)
+            if tag is None:
+                continue
+            tag = tag.lower()
+            if perform is None:
+                if tag == 'div' and not closing and 'perform-list' in _classes(source):
+                    perform = {'depth': 1, 'date': None, 'place': None, 'available': False, 'lead': None, 'p': None}
+                continue
+
+            if tag == 'div':
+                if closing:
+                    perform['depth'] -= 1
+                    # 日時（div.lead）の終了
+                    if perform['lead'] is not None and perform['depth'] == perform['lead'][1]:
+                        perform['date'] = _text(html[perform['lead'][0]:m.start()])
+                        perform['lead'] = None
+                    # perform-listの終了
+                    if perform['depth'] == 0:
+                        performs.append(self._finish(perform))
+                        perform = None
+                elif not source.rstrip().endswith('/'):
+                    if perform['date'] is None and perform['lead'] is None and 'lead' in _classes(source):
+                        perform['lead'] = (m.end(), perform['depth'])
+                    perform['depth'] += 1
+            elif tag == 'p':
+                # 会場（最初のp）
+                if not closing and perform['place'] is None and perform['p'] is None:
+                    perform['p'] = m.end()
+                elif closing and perform['place'] is None and perform['p'] is not None:
+                    perform['place'] = _text(html[perform['p']:m.start()])
+            elif tag == 'button' and not closing and 'btn' in _classes(source):
+                perform['available'] = True
+
+        if perform is not None:
+            performs.append(self._finish(perform))
+        return performs
+
+    def _finish(self, perform: dict):
+        """走査中の公演情報を結果の形式に変換する"""
+        if perform['date'] is None or perform['place'] is None:
+            raise ValueError('perform-list に日時または会場が見つかりませんでした')
+        return {
+            'date': perform['date'],
+            'place': perform['place'],
+            'available': perform['available']
+        }
+
+
+def _as_key(item):
+    """比較のため、抽出結果の要素をハッシュ可能な値に変換する"""
+    return tuple(sorted(item.items())) if isinstance(item, dict) else item
+
+
+class ShadowExtractor(Extractor):
+    """主となる抽出クラスと同じHTMLで候補の抽出クラスを実行し、結果を比較する
+
+    ページごとに両方の解析時間と結果の差分をメトリクスとして出力する。
+    通知に使う結果は常に主となる抽出クラスのもので、
+    候補の抽出クラスで例外が発生しても結果には影響しない。
+    """
+
+    def __init__(self, primary: Extractor, candidate: Extractor):
+        """
+        Parameters
+        ----------
+        primary : Extractor
+            結果を返す抽出クラス
+        candidate : Extractor
+            比較対象の抽出クラス
+        """
+        self.primary = primary
+        self.candidate = candidate
+        self.name = f"{primary.name}+{candidate.name}"
+
+    def _shadow(self, method: str, html: str):
+        start = time.perf_counter()
+        result = getattr(self.primary, method)(html)
+        primary_time = (time.perf_counter() - start) * 1000
+
+        candidate_error = 0
+        candidate_time = 0.0
+        missing = []
+        extra = []
+        try:
+            start = time.perf_counter()
+            candidate_result = getattr(self.candidate, method)(html)
+            candidate_time = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            candidate_error = 1
+            print(f"{self.candidate.name} の {method} でエラーが発生しました:", e)
+        else:
+            if candidate_result != result:
+                candidate_keys = {_as_key(item) for item in candidate_result}
+                primary_keys = {_as_key(item) for item in result}
+                missing = [item for item in result if _as_key(item) not in candidate_keys]
+                extra = [item for item in candidate_result if _as_key(item) not in primary_keys]
+                print(f"{method} の結果が一致しません:", {
+                    'missing': missing,
+                    'extra': extra,
+                    self.primary.name: result,
+                    self.candidate.name: candidate_result
+                })
+
+        put_metrics(
+            {
+                'PrimaryParseTime': primary_time,
+                'CandidateParseTime': candidate_time,
+                'ShadowMismatch': int(bool(missing or extra)),
+                'ShadowCandidateError': candidate_error,
+                # 空きの見逃しと誤検知（候補に切り替えた場合に通知が変わるもの）
+                'ShadowMissedAvailable': sum(1 for item in missing if isinstance(item, dict) and item.get('available')),
+                'ShadowFalseAvailable': sum(1 for item in extra if isinstance(item, dict) and item.get('available'))
+            },
+            dimensions={
+                'Method': method,
+                'Primary': self.primary.name,
+                'Candidate': self.candidate.name
+            },
+            units={
+                'PrimaryParseTime': 'Milliseconds',
+                'CandidateParseTime': 'Milliseconds'
+            }
+        )
+        return result
+
+    def event_links(self, html: str):
+        return self._shadow('event_links', html)
+
+    def performs(self, html: str):
+        return self._shadow('performs', html)
+
+
+class PerformStreamParser(HTMLParser):
+    """チャンクごとに与えられたHTMLから perform-list を逐次取り出すパーサー
+
+    perform-list が閉じるたびに公演情報を completed に追加する。
+    end_tag を指定した場合は、その要素が閉じた時点で done を True にし、
+    それ以降は読み込む必要がないことを示す。
+    perform-list はページ内の離れた場所に複数まとまっていることがあるため、
+    end_tag を指定しない場合はページの最後まで読む。
+    """
+
+    def __init__(self, end_tag: str = None):
+        """
+        Parameters
+        ----------
+        end_tag : str
+            これが閉じたら以降に perform-list がないと分かっている要素のタグ名（main など）
+        """
+        super().__init__(convert_charrefs=True)
+        self.end_tag = end_tag or None
+        self.completed = []
+        self.done = False
+        self._div_depth = 0
+        self._perform = None
+        self._lead = None
+        self._place = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        classes = (dict(attrs).get('class') or '').split()
+        if tag == 'div':
+            self._div_depth += 1
+            if self._perform is None:
+                if 'perform-list' in classes:
+                    self._perform = {'depth': self._div_depth, 'date': None, 'place': None, 'available': False}
+            elif self._perform['date'] is None and self._lead is None and 'lead' in classes:
+                # 日時（div.lead）の開始
+                self._lead = (self._div_depth, [])
+        elif self._perform is not None:
+            if tag == 'p' and self._perform['place'] is None and self._place is None:
+                # 会場（最初のp）の開始
+                self._place = (self._div_depth, [])
+            elif tag == 'button' and 'btn' in classes:
+                self._perform['available'] = True
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == 'div':
+            if self._perform is not None:
+                # 閉じられていないpは、それを含むdivが閉じた時点で閉じる
+                if self._place is not None and self._div_depth == self._place[0]:
+                    self._close_place()
+                if self._lead is not None and self._div_depth == self._lead[0]:
+                    self._perform['date'] = ''.join(self._lead[1])
+                    self._lead = None
+                if self._div_depth == self._perform['depth']:
+                    self._finish()
+            self._div_depth -= 1
+        elif tag == 'p' and self._place is not None:
+            self._close_place()
+        # end_tag が閉じたら以降は読まない
+        if tag == self.end_tag and self._perform is None:
+            self.done = True
+
+    def handle_data(self, data):
+        if self._lead is not None:
+            self._lead[1].append(data)
+        if self._place is not None:
+            self._place[1].append(data)
+
+    def _close_place(self):
+        """会場（最初のp）の終了"""
+        self._perform['place'] = ''.join(self._place[1])
+        self._place = None
+
+    def _finish(self):
+        """走査中の公演情報を completed に追加する"""
+        perform = self._perform
+        self._perform = None
+        if perform['date'] is None or perform['place'] is None:
+            raise ValueError('perform-list に日時または会場が見つかりませんでした')
+        self.completed.append({
+            'date': perform['date'],
+            'place': perform['place'],
+            'available': perform['available']
+        })
+
+    def pop_completed(self):
+        """取り出し済みの公演情報を返して空にする"""
+        completed, self.completed = self.completed, []
+        return completed
+
+
+def iter_performs(chunks, encoding: str, end_tag: str = None):
+    """ダウンロード中のイベントページから公演情報を逐次取り出す
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        レスポンスボディのチャンク
+    encoding : str
+        レスポンスボディの文字コード
+    end_tag : str
+        これが閉じたら読み込みをやめる要素のタグ名（省略時は最後まで読む）
+
+    Yields
+    ------
+    dict
+        公演ごとの日時(date)、会場(place)、「購入手続きへ」ボタンの有無(available)
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    parser = PerformStreamParser(end_tag)
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        yield from parser.pop_completed()
+        if parser.done:
+            # end_tag が閉じたので、残りは読まない
+            return
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.pop_completed()
+
+
+def may_have_buy_button(content: bytes, encoding: str = 'utf-8', marker: str = BUY_BUTTON_MARKER):
+    """イベントページに「購入手続きへ」ボタンがある可能性を調べる
+
+    DOMを構築せずにバイト列を検索するだけなので、マーカーが見つからなければ
+    どの公演にも空きがないと判断して解析を省略できる。
+    マーカーが見つかった場合は通常どおり解析する。
+    マーカーをページのエンコーディングで表せない場合や、レスポンスボディが
+    そのエンコーディングで正しく読めない場合（<meta> だけで別の文字コードを指定しているなど）は、
+    判断できないため True を返す。
+
+    Parameters
+    ----------
+    content : bytes
+        イベントページのレスポンスボディ
+    encoding : str
+        レスポンスボディのエンコーディング
+    marker : str
+        「購入手続きへ」ボタンの目印となる文字列
+
+    Returns
+    -------
+    bool
+        マーカーが含まれている可能性があれば True
+    """
+    try:
+        if marker.encode(encoding) in content:
+            return True
+        # 見つからなかったのが別の文字コードで書かれているためでないことを確かめる
+        content.decode(encoding)
+    except (LookupError, UnicodeError):
+        return True
+    return False
+
+
+class StreamExtractor(Extractor):
+    """ストリーミング用のパーサー（PerformStreamParser）による抽出
+
+    CRAWL_STREAMING で使うパーサーを HTML_SHADOW_BACKEND で検証するためのもの。
+    イベントページへのリンクは html.parser で取得する。
+    """
+
+    name = 'stream'
+
+    def __init__(self):
+        self._soup = SoupExtractor()
+
+    def event_links(self, html: str):
+        return self._soup.event_links(html)
+
+    def performs(self, html: str):
+        parser = PerformStreamParser()
+        parser.feed(html)
+        parser.close()
+        return parser.pop_completed()
+
+
+# バックエンド名と抽出クラスのマッピング
+extractors = {
+    SoupExtractor.name: SoupExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+    SelectolaxExtractor.name: SelectolaxExtractor,
+    RegexExtractor.name: RegexExtractor,
+    StreamExtractor.name: StreamExtractor,
+}
+
+
+def get_extractor(name: str = HTML_PARSER_BACKEND):
+    """バックエンド名から抽出クラスのインスタンスを生成する
+
+    未知のバックエンド名や、ライブラリがインストールされていない場合は
+    html.parser にフォールバックする。
+
+    Parameters
+    ----------
+    name : str
+        バックエンド名
+
+    Returns
+    -------
+    Extractor
+        抽出クラスのインスタンス
+    """
+    extractor_class = extractors.get(name)
+    if extractor_class is None:
+        print(f"未知のHTMLパーサーです: {name}（html.parser を使用します）")
+        return SoupExtractor()
+    try:
+        return extractor_class()
+    except ImportError as e:
+        print(f"{name} を読み込めませんでした: {e}（html.parser を使用します）")
+        return SoupExtractor()
+
+
+def build_extractor(name: str = HTML_PARSER_BACKEND, shadow: str = HTML_SHADOW_BACKEND):
+    """環境変数の設定に従って抽出クラスを生成する
+
+    Parameters
+    ----------
+    name : str
+        結果を返すバックエンド名
+    shadow : str
+        シャドー実行で比較するバックエンド名（空の場合は比較しない）
+
+    Returns
+    -------
+    Extractor
+        抽出クラスのインスタンス
+    """
+    extractor = get_extractor(name)
+    if shadow:
+        return ShadowExtractor(extractor, get_extractor(shadow))
+    return extractor
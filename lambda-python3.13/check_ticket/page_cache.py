@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+
+
+# キャッシュファイルの保存先（実行環境が再利用される間は残る）
+PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH', '/tmp/check_ticket_page_cache.json')
+
+
+class PageCache:
+    """URLごとの検証子（ETag / Last-Modified）と解析結果のキャッシュ
+
+    前回取得時の検証子を条件付きGETのヘッダーとして送り、
+    304 Not Modified が返ってきた場合は前回の解析結果を再利用する。
+    検証子に対応していないサーバーに備えて、レスポンスボディのハッシュも保存し、
+    前回と同じ内容であれば解析をスキップできるようにする。
+    エントリは /tmp のJSONファイルに保存し、実行をまたいで引き継ぐ。
+    """
+
+    def __init__(self, path: str = PAGE_CACHE_PATH):
+        """
+        Parameters
+        ----------
+        path : str
+            キャッシュファイルのパス
+        """
+        self.path = path
+        self.entries = {}
+        self._loaded = False
+        self._visited = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """キャッシュファイルを読み込み、今回の実行で参照したURLの記録をリセットする"""
+        with self._lock:
+            self._visited = set()
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except FileNotFoundError:
+                self.entries = {}
+            except (OSError, ValueError) as e:
+                print('PageCache load error:', e)
+                self.entries = {}
+
+    def save(self):
+        """今回の実行で参照しなかったURLを削除してキャッシュファイルに書き出す"""
+        with self._lock:
+            # アーティストページから外れたURLのエントリを削除
+            for url in set(self.entries) - self._visited:
+                del self.entries[url]
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print('PageCache save error:', e)
+
+    def conditional_headers(self, url: str):
+        """条件付きGETのリクエストヘッダーを取得する
+
+        Parameters
+        ----------
+        url : str
+            取得するページのURL
+
+        Returns
+        -------
+        dict
+            If-None-Match / If-Modified-Since ヘッダー（キャッシュがなければ空）
+        """
+        with self._lock:
+            self._visited.add(url)
+            entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, url: str):
+        """キャッシュされた解析結果を取得する
+
+        Parameters
+        ----------
+        url : str
+            ページのURL
+
+        Returns
+        -------
+        any
+            前回の解析結果 or None
+        """
+        with self._lock:
+            entry = self.entries.get(url)
+        return entry['result'] if entry else None
+
+    def get_by_body(self, url: str, digest: str):
+        """レスポンスボディが前回と同じ場合に、キャッシュされた解析結果を取得する
+
+        Parameters
+        ----------
+        url : str
+            ページのURL
+        digest : str
+            今回のレスポンスボディのハッシュ
+
+        Returns
+        -------
+        any
+            前回の解析結果（ボディが変わっている場合は None）
+        """
+        with self._lock:
+            entry = self.entries.get(url)
+        if entry and entry.get('hash') == digest:
+            return entry['result']
+        return None
+
+    def put(self, url: str, headers, digest: str, result):
+        """レスポンスの検証子、ボディのハッシュ、解析結果を保存する
+
+        Parameters
+        ----------
+        url : str
+            ページのURL
+        headers : Mapping
+            レスポンスヘッダー
+        digest : str
+            レスポンスボディのハッシュ
+        result : any
+            JSONに変換できる解析結果
+        """
+        entry = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': digest,
+            'result': result
+        }
+        with self._lock:
+            self._visited.add(url)
+            self.entries[url] = entry
+
+
+def body_digest(content: bytes):
+    """レスポンスボディのハッシュを計算する
+
+    Parameters
+    ----------
+    content : bytes
+        レスポンスボディ
+
+    Returns
+    -------
+    str
+        16進数表記のハッシュ
+    """
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
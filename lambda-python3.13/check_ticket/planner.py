@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+import time
+
+
+from line_client import LineClient
+from metrics import put_metrics
+
+
+# メッセージ送信数の上限と送信数をキャッシュする秒数
+QUOTA_CACHE_TTL = int(os.environ.get('QUOTA_CACHE_TTL', '60'))
+
+# 日付（2025/1/1、2025年1月1日、2025-01-01 など）を取り出す正規表現
+_DATE_RE = re.compile(r'(\d{4})\s*[/年.\-]\s*(\d{1,2})\s*[/月.\-]\s*(\d{1,2})')
+
+_quota_cache = {'expires_at': 0, 'remaining': None}
+_quota_lock = threading.Lock()
+
+
+def remaining_quota(client: LineClient):
+    """今月の残りのメッセージ送信数を取得する
+
+    /v2/bot/message/quota と /v2/bot/message/quota/consumption の結果を
+    QUOTA_CACHE_TTL 秒間キャッシュする。取得に失敗した場合は上限なしとして扱う。
+
+    Parameters
+    ----------
+    client : LineClient
+        LINE Messaging API のクライアント
+
+    Returns
+    -------
+    int or None
+        残りの送信数（上限がない場合は None）
+    """
+    with _quota_lock:
+        if _quota_cache['expires_at'] > time.time():
+            return _quota_cache['remaining']
+        try:
+            quota = client.get_quota()
+            if quota.get('type') == 'limited':
+                consumption = client.get_quota_consumption()
+                remaining = max(0, quota['value'] - consumption.get('totalUsage', 0))
+            else:
+                remaining = None
+        except Exception as e:
+            # 送信数を確認できなくても通知は止めない
+            print('メッセージ送信数を取得できませんでした:', e)
+            return None
+        print('remaining quota:', remaining)
+        _quota_cache.update(expires_at=time.time() + QUOTA_CACHE_TTL, remaining=remaining)
+        return remaining
+
+
+def consume_quota(count: int):
+    """キャッシュした残りの送信数から送信した数を差し引く
+
+    Parameters
+    ----------
+    count : int
+        送信したメッセージ数
+    """
+    with _quota_lock:
+        if _quota_cache['remaining'] is not None:
+            _quota_cache['remaining'] = max(0, _quota_cache['remaining'] - count)
+
+
+def _soonest_date(tickets: list):
+    """チケットの中で最も早い公演日を (年, 月, 日) で取得する。不明な場合は末尾に並ぶ値を返す"""
+    dates = []
+    for ticket in tickets:
+        m = _DATE_RE.search(ticket['date'])
+        if m:
+            dates.append(tuple(int(v) for v in m.groups()))
+    return min(dates) if dates else (9999, 12, 31)
+
+
+def plan_notifications(client: LineClient, notifications: list):
+    """残りの送信数に収まるように通知を選ぶ
+
+    送信数が足りる場合はすべての通知をそのまま返す。
+    足りない場合は公演日が早い順、次に登録ユーザー数が多い順に優先し、
+    収まらない分は送信先を減らすか、送信を見送る。
+
+    Parameters
+    ----------
+    client : LineClient
+        LINE Messaging API のクライアント
+    notifications : list[dict]
+        アーティスト(artist)、空きのあるチケット(tickets)、
+        登録ユーザー数(subscriber_count)、送信先(users)を含む通知
+
+    Returns
+    -------
+    tuple[list[dict], list[dict]]
+        送信する通知と、送信を見送る通知（送信先は見送るユーザーのみ）
+    """
+    cost = sum(len(notification['users']) for notification in notifications)
+    if cost == 0:
+        # 送信するものがなければ、送信数の上限を確認しない
+        return notifications, []
+    remaining = remaining_quota(client)
+    if remaining is None or cost <= remaining:
+        return notifications, []
+
+    print('メッセージ送信数が不足しています:', {'cost': cost, 'remaining': remaining})
+    ordered = sorted(
+        notifications,
+        key=lambda notification: (_soonest_date(notification['tickets']), -notification['subscriber_count'])
+    )
+    planned = []
+    deferred = []
+    for notification in ordered:
+        users = notification['users']
+        if remaining > 0:
+            planned.append({**notification, 'users': users[:remaining]})
+        if len(users) > remaining:
+            deferred.append({**notification, 'users': users[max(remaining, 0):]})
+        remaining -= min(remaining, len(users))
+
+    put_metrics({
+        'QuotaEstimatedCost': cost,
+        'QuotaDeferredMessages': sum(len(notification['users']) for notification in deferred)
+    })
+    return planned, deferred
@@ -0,0 +1,41 @@
+import boto3
+from boto3.dynamodb.conditions import Key
+
+
+dynamodb = boto3.resource('dynamodb')
+
+
+def iter_subscribers(artist: str):
+    """アーティストを登録しているユーザーIDを順に返す
+
+    artist-index のクエリを LastEvaluatedKey がなくなるまでページングし、
+    userId だけを取得する。
+
+    Parameters
+    ----------
+    artist : str
+        アーティスト名
+
+    Yields
+    ------
+    str
+        ユーザーID
+    """
+    table = dynamodb.Table('TicketBotUsers')
+    kwargs = {
+        'IndexName': 'artist-index',
+        'KeyConditionExpression': Key('artist').eq(artist),
+        'ProjectionExpression': 'userId'
+    }
+    page = 0
+    while True:
+        response = table.query(**kwargs)
+        page += 1
+        items = response.get('Items', [])
+        print('query page:', {'artist': artist, 'page': page, 'count': len(items)})
+        for item in items:
+            yield item['userId']
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_evaluated_key
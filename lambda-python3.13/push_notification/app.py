@@ -1,18 +1,24 @@
 import boto3
 import json
-import requests
  
 
+from delivery import DeliveryContext
+from dispatcher import dispatch
+from line_client import LineClient
 from utils import (
     display_names,
     get_ssm_parameter,
-    get_token
+    get_token,
+    prepare_token
 )
 
 
 dynamodb = boto3.resource('dynamodb')
 ssm = boto3.client('ssm')
 
+# 初期化フェーズでアクセストークンを取得し、期限が近ければ事前に更新を始める
+prepare_token()
+
 
 BUTTON_CHECK_CURRENT_ARTIST = '現在の設定を確認'
 BUTTON_CHANGE_ARTIST = '設定を変更'
@@ -41,13 +47,15 @@ MESSAGE_SELECT_ARTIST = {
 }
 
 
-def handle_message(event: any):
+def handle_message(event: any, delivery: DeliveryContext):
     """ユーザーからのメッセージイベントの処理
 
     Parameters
     ----------
     event : any
         イベントデータ
+    delivery : DeliveryContext
+        配信ごとに共有する値とクライアント
     """
     print('handle_message event:', event)
     user_id = event['source']['userId']
@@ -57,8 +65,7 @@ def handle_message(event: any):
 
     if message_text == BUTTON_CHECK_CURRENT_ARTIST:
         # TicketBotUsersからユーザーのアーティスト設定を取得
-        table = dynamodb.Table('TicketBotUsers')
-        response = table.get_item(Key={'userId': user_id})
+        response = delivery.dynamodb.get_item(TableName='TicketBotUsers', Key={'userId': user_id})
         if 'Item' in response:
             artist = response['Item'].get('artist', '未設定')
             reply_messages.append({
@@ -81,83 +88,55 @@ def handle_message(event: any):
         })
 
     # ユーザーに返信メッセージを送信
-    token = get_token(
-        get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
-        get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
-    )
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    message = {
-        "replyToken": reply_token,
-        "messages": reply_messages
-    }
-    response = requests.post(
-        'https://api.line.me/v2/bot/message/reply',
-        headers=headers,
-        json=message
-    )
-    response.raise_for_status()  # エラー時に例外を投げる
+    response = delivery.line.reply(reply_token, reply_messages)
     print('handle_message response:', response.json())
 
 
-def handle_follow(event: any):
+def handle_follow(event: any, delivery: DeliveryContext):
     """友だち追加イベントの処理
 
     Parameters
     ----------
     event : any
         イベントデータ
+    delivery : DeliveryContext
+        配信ごとに共有する値とクライアント
     """
     print('handle_follow event:', event)
     user_id = event['source']['userId']
-    token = get_token(
-        get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
-        get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
-    )
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'to': user_id,
-        'messages': [MESSAGE_SELECT_ARTIST]
-    }
-    response = requests.post(
-        'https://api.line.me/v2/bot/message/push',
-        headers=headers,
-        json=payload
-    )
-    response.raise_for_status()  # エラー時に例外を投げる
+    response = delivery.line.push(user_id, [MESSAGE_SELECT_ARTIST])
     print('handle_follow response:', response.json())
 
 
-def handle_unfollow(event: any):
+def handle_unfollow(event: any, delivery: DeliveryContext):
     """友だち解除イベントの処理
 
     Parameters
     ----------
     event : any
         イベントデータ
+    delivery : DeliveryContext
+        配信ごとに共有する値とクライアント
     """
     print('handle_unfollow event:', event)
     user_id = event['source']['userId']
-    table = dynamodb.Table('TicketBotUsers')
-    table.delete_item(
+    delivery.dynamodb.delete_item(
+        TableName='TicketBotUsers',
         Key={
             'userId': user_id
         }
     )
 
 
-def handle_postback(event: any):
+def handle_postback(event: any, delivery: DeliveryContext):
     """リッチメニューなどからのアクションイベントの処理
 
     Parameters
     ----------
     event : any
         イベントデータ
+    delivery : DeliveryContext
+        配信ごとに共有する値とクライアント
     """
     print('handle_postback event:', event)
 
@@ -165,8 +144,8 @@ def handle_postback(event: any):
     user_id = event['source']['userId']
     postback_data = event['postback']['data']
     artist = postback_data.split('artist=')[-1]
-    table = dynamodb.Table('TicketBotUsers')
-    table.put_item(
+    delivery.dynamodb.put_item(
+        TableName='TicketBotUsers',
         Item={
             'userId': user_id,
             'artist': artist
@@ -175,32 +154,49 @@ def handle_postback(event: any):
 
     # ユーザーに登録完了のメッセージを送信
     reply_token = event['replyToken']
-    message = {
-        "replyToken": reply_token,
-        "messages": [
-            {
-                "type": "text",
-                "text": f"{display_names[artist]} を登録しました。"
-            }
-        ]
-    }
-    token = get_token(
-        get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
-        get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
-    )
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.post(
-        'https://api.line.me/v2/bot/message/reply',
-        headers=headers,
-        json=message
-    )
-    response.raise_for_status()  # エラー時に例外を投げる
+    messages = [
+        {
+            "type": "text",
+            "text": f"{display_names[artist]} を登録しました。"
+        }
+    ]
+    response = delivery.line.reply(reply_token, messages)
     print('handle_postback response:', response.json())
 
 
+def handle_event(event: any, delivery: DeliveryContext):
+    """イベントの種類に応じたハンドラーを呼び出す
+
+    Parameters
+    ----------
+    event : any
+        イベントデータ
+    delivery : DeliveryContext
+        配信ごとに共有する値とクライアント
+    """
+    event_type = event.get('type')
+    if event_type == 'message':     # ユーザーからのメッセージ
+        handle_message(event, delivery)
+
+    elif event_type == 'follow':    # 友だち追加
+        handle_follow(event, delivery)
+
+    elif event_type == 'unfollow':  # 友だち解除
+        handle_unfollow(event, delivery)
+
+    elif event_type == 'join':      # グループや複数人トークへの参加
+        pass
+
+    elif event_type == 'leave':     # グループや複数人トークからの退出
+        pass
+
+    elif event_type == 'postback':  # リッチメニューなどからのアクション
+        handle_postback(event, delivery)
+
+    elif event_type == 'beacon':    # ビーコン検知イベント
+        pass
+
+
 def lambda_handler(event, context):
     """push_notification Lambda function
 
@@ -224,59 +220,39 @@ def lambda_handler(event, context):
     """
     print('event', event)
 
+    delivery = None
     try:
         body = json.loads(event['body'])
-        for e in body.get('events', []):
-            event_type = e.get('type')
-            if event_type == 'message':     # ユーザーからのメッセージ
-                handle_message(e)
-
-            elif event_type == 'follow':    # 友だち追加
-                handle_follow(e)
-
-            elif event_type == 'unfollow':  # 友だち解除
-                handle_unfollow(e)
-
-            elif event_type == 'join':      # グループや複数人トークへの参加
-                pass
-
-            elif event_type == 'leave':     # グループや複数人トークからの退出
-                pass
-
-            elif event_type == 'postback':  # リッチメニューなどからのアクション
-                handle_postback(e)
-
-            elif event_type == 'beacon':    # ビーコン検知イベント
-                pass
+        # アクセストークンとクライアントは必要になった時点で配信ごとに1回だけ用意し、すべてのイベントで共有する
+        delivery = DeliveryContext()
+        # ユーザーごとに順序を保ちながら並行して処理し、失敗したイベントは最後にまとめて報告する
+        results = dispatch(body.get('events', []), lambda e: handle_event(e, delivery))
+        failed = [result for result in results if not result['ok']]
+        if failed:
+            raise RuntimeError(', '.join(f"event {result['index']} ({result['type']}): {result['error']}" for result in failed))
 
     except Exception as e:
         # エラーが発生した場合、管理者に通知
         print('Error:', e)
-        token = get_token(
-            get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
-            get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
-        )
+        if delivery is not None:
+            line = delivery.line
+        else:
+            token = get_token(
+                get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
+                get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
+            )
+            line = LineClient(token)
         admin_line_user_id = get_ssm_parameter('TICKET_ADMIN_LINE_USER_ID')
 
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        message = {
-            'to': admin_line_user_id,
-            'messages': [
+        response = line.push(
+            admin_line_user_id,
+            [
                 {
                     'type': 'text',
                     'text': f'Error occurred in check_ticket: {str(e)}'
                 }
             ]
-        }
-        response = requests.post(
-            'https://api.line.me/v2/bot/message/push',
-            headers=headers,
-            json=message
         )
-        response.raise_for_status()  # エラー時に例外を投げる
         print('Error notification response:', response.json())
 
         return {
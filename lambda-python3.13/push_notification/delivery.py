@@ -0,0 +1,50 @@
+import threading
+
+import boto3
+
+
+from line_client import LineClient
+from utils import (
+    get_ssm_parameter,
+    get_token
+)
+
+
+dynamodb = boto3.resource('dynamodb')
+
+
+class DeliveryContext:
+    """1回の Webhook 配信の中で、すべてのイベントの処理が共有する値とクライアント
+
+    アクセストークンは最初に必要になった時点で配信ごとに1回だけ取得し、
+    各ハンドラーはこのオブジェクトを通して LINE Messaging API と DynamoDB を呼び出す。
+    イベントのない配信（Webhook URLの検証など）では SSM や DynamoDB を呼び出さない。
+    """
+
+    def __init__(self):
+        # イベントは複数のスレッドで並行して処理するため、スレッドセーフな低レベルのクライアントを共有する
+        # （リソースの Table はスレッドセーフではない）
+        self.dynamodb = dynamodb.meta.client
+        self._token = None
+        self._line = None
+        self._lock = threading.Lock()
+
+    @property
+    def token(self):
+        """アクセストークン"""
+        with self._lock:
+            if self._token is None:
+                self._token = get_token(
+                    get_ssm_parameter('TICKET_LINE_CHANNEL_ID'),
+                    get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET')
+                )
+            return self._token
+
+    @property
+    def line(self):
+        """アクセストークンを設定した LINE Messaging API のクライアント"""
+        token = self.token
+        with self._lock:
+            if self._line is None:
+                self._line = LineClient(token)
+            return self._line
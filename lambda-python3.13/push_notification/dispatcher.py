@@ -0,0 +1,96 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+from metrics import put_metrics
+
+
+# イベントを並行して処理する数
+EVENT_MAX_WORKERS = int(os.environ.get('EVENT_MAX_WORKERS', '4'))
+
+
+def _ordering_key(event: dict, index: int):
+    """順序を保つ単位のキーを取得する
+
+    同じユーザー（グループ、複数人トーク）のイベントは同じキーになる。
+    送信元がないイベントは他と順序を揃える必要がないため、イベントごとに別のキーにする。
+    """
+    source = event.get('source', {})
+    for name in ('userId', 'groupId', 'roomId'):
+        if source.get(name):
+            return (name, source[name])
+    return ('index', index)
+
+
+def _run_events(indexed_events: list, handle):
+    """同じキーのイベントを届いた順に処理する
+
+    1つのイベントが失敗しても、続くイベントの処理は続ける。
+
+    Returns
+    -------
+    list[dict]
+        イベントの位置(index)、種類(type)、成否(ok)、エラー内容(error)、処理時間(latency_ms)
+    """
+    results = []
+    for index, event in indexed_events:
+        start = time.perf_counter()
+        try:
+            handle(event)
+            error = None
+        except Exception as e:
+            print('Error in event:', {'index': index, 'type': event.get('type'), 'error': str(e)})
+            error = e
+        latency_ms = round((time.perf_counter() - start) * 1000, 1)
+        results.append({
+            'index': index,
+            'type': event.get('type'),
+            'ok': error is None,
+            'error': error,
+            'latency_ms': latency_ms
+        })
+    return results
+
+
+def dispatch(events: list, handle):
+    """Webhookのイベントを並行して処理する
+
+    イベントを送信元のユーザーごとにまとめ、EVENT_MAX_WORKERS 個のスレッドで並行して処理する。
+    同じユーザーのイベント（友だち追加の後のポストバックなど）は届いた順に処理する。
+    イベントごとの処理時間は EventLatency メトリクスとして出力する。
+
+    Parameters
+    ----------
+    events : list[dict]
+        Webhookのイベント
+    handle : Callable[[dict], None]
+        1つのイベントを処理する関数
+
+    Returns
+    -------
+    list[dict]
+        イベントの位置(index)、種類(type)、成否(ok)、エラー内容(error)、処理時間(latency_ms)
+        （イベントが届いた順）
+    """
+    groups = {}
+    for index, event in enumerate(events):
+        groups.setdefault(_ordering_key(event, index), []).append((index, event))
+    if not groups:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(EVENT_MAX_WORKERS, len(groups))) as executor:
+        futures = [executor.submit(_run_events, group, handle) for group in groups.values()]
+        results = sorted(
+            (result for future in futures for result in future.result()),
+            key=lambda result: result['index']
+        )
+
+    for result in results:
+        print('event result:', {key: result[key] for key in ('index', 'type', 'ok', 'latency_ms')})
+        put_metrics(
+            {'EventLatency': result['latency_ms'], 'EventFailed': 0 if result['ok'] else 1},
+            dimensions={'EventType': str(result['type'])},
+            units={'EventLatency': 'Milliseconds'}
+        )
+    return results
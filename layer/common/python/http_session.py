@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+# 接続タイムアウトと読み取りタイムアウト（秒）
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+# ホストごとに保持するコネクション数
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))
+# Content-Typeに文字コードがない場合に使う文字コード
+HTTP_DEFAULT_ENCODING = os.environ.get('HTTP_DEFAULT_ENCODING', 'utf-8')
+
+
+class PooledSession(requests.Session):
+    """既定のタイムアウトを適用するコネクションプール付きのセッション
+
+    モジュールスコープで生成しておくことで、ウォームスタート時は
+    relief-ticket.jp や api.line.me とのTCP/TLS接続を使い回せる。
+    """
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), pool_maxsize: int = HTTP_POOL_MAXSIZE):
+        """
+        Parameters
+        ----------
+        timeout : float or tuple[float, float]
+            リクエストごとにタイムアウトが指定されなかった場合の既定値
+        pool_maxsize : int
+            ホストごとに保持するコネクション数
+        """
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        # brotli がインストールされていれば br も受け付ける
+        self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+# Lambdaの実行環境が再利用される間はこのセッションを共有する
+session = PooledSession()
+
+
+# 文字コードの決定方法ごとの回数（declared / default / detected）
+decode_counter = Counter()
+_decode_lock = threading.Lock()
+
+
+def _declared_encoding(content_type: str):
+    """Content-Typeヘッダーから文字コードを取り出す"""
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def response_encoding(res, default_encoding: str = HTTP_DEFAULT_ENCODING):
+    """レスポンスのContent-Typeで宣言された文字コードを取得する
+
+    Parameters
+    ----------
+    res : requests.Response
+        レスポンス
+    default_encoding : str
+        Content-Typeに文字コードがない場合に使う文字コード
+
+    Returns
+    -------
+    str
+        文字コード
+    """
+    return _declared_encoding(res.headers.get('Content-Type', '')) or default_encoding
+
+
+def decode_content(res, default_encoding: str = HTTP_DEFAULT_ENCODING):
+    """レスポンスボディを文字コードの推定なしでデコードする
+
+    Content-Typeで宣言された文字コード、なければ既定の文字コードでデコードする。
+    デコードできなかった場合に限り、requests の文字コード推定にフォールバックする。
+
+    Parameters
+    ----------
+    res : requests.Response
+        レスポンス
+    default_encoding : str
+        Content-Typeに文字コードがない場合に使う文字コード
+
+    Returns
+    -------
+    str
+        デコードしたレスポンスボディ
+    """
+    declared = _declared_encoding(res.headers.get('Content-Type', ''))
+    try:
+        text = res.content.decode(declared or default_encoding)
+        method = 'declared' if declared else 'default'
+    except (LookupError, UnicodeDecodeError):
+        text = res.content.decode(res.apparent_encoding or default_encoding, errors='replace')
+        method = 'detected'
+        print('文字コードを推定しました:', res.url)
+    with _decode_lock:
+        decode_counter[method] += 1
+    return text
@@ -0,0 +1,314 @@
+import os
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+
+from http_session import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, session
+
+
+LINE_API_BASE_URL = 'https://api.line.me'
+# 429 / 5xx / 通信エラー時の最大再試行回数
+LINE_MAX_RETRIES = int(os.environ.get('LINE_MAX_RETRIES', '3'))
+# 再試行までに待つ秒数の上限（Retry-After がこれより長い場合は再試行しない）
+LINE_MAX_BACKOFF = float(os.environ.get('LINE_MAX_BACKOFF', '4'))
+
+# エンドポイントごとのレート制限（リクエスト/秒）
+RATE_LIMITS = {
+    '/v2/bot/message/multicast': 200,
+    '/v2/bot/message/push': 2000,
+    '/v2/bot/message/reply': 2000,
+    '/v2/oauth/accessToken': 100,
+}
+
+
+class TokenBucket:
+    """トークンバケットによるレート制限"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Parameters
+        ----------
+        rate : float
+            1秒あたりに補充するトークン数
+        capacity : float
+            バケットの容量（省略時は rate と同じ）
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する。足りない場合は補充されるまで待機する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Lambdaの実行環境が再利用される間は同じバケットを共有する
+_buckets = {path: TokenBucket(rate) for path, rate in RATE_LIMITS.items()}
+
+# 401 が返ってきたときに、拒否されたアクセストークンを渡して呼び出す関数
+_unauthorized_listeners = []
+
+
+def add_unauthorized_listener(listener):
+    """401 Unauthorized が返ってきたときに呼び出す関数を登録する
+
+    アクセストークンのキャッシュを持つモジュールが、失効したトークンを破棄するために使う。
+
+    Parameters
+    ----------
+    listener : Callable[[str], None]
+        拒否されたアクセストークンを受け取る関数
+    """
+    _unauthorized_listeners.append(listener)
+
+
+def _retry_after(response: requests.Response):
+    """Retry-Afterヘッダーの秒数を取得する"""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def max_request_seconds():
+    """再試行を含めて1回のリクエストにかかりうる最大秒数を取得する
+
+    すべての試行が接続と読み込みのタイムアウトまでかかり、
+    その間に LINE_MAX_BACKOFF 秒ずつ待った場合の合計。
+
+    Returns
+    -------
+    float
+        最大秒数
+    """
+    attempts = LINE_MAX_RETRIES + 1
+    return attempts * (HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT) + LINE_MAX_RETRIES * LINE_MAX_BACKOFF
+
+
+class LineClient:
+    """LINE Messaging API のクライアント
+
+    共有のコネクションプール付きセッションを使い、エンドポイントごとの
+    トークンバケットでレート制限を守る。
+    429 と 5xx、通信エラーは Retry-After（なければ指数バックオフ）に従って再試行し、
+    Retry-After が LINE_MAX_BACKOFF 秒を超える場合は待たずにエラーにする。
+    401 が返ってきた場合は add_unauthorized_listener で登録した関数に通知してからエラーにする。
+    push と multicast は X-Line-Retry-Key を付けて再試行しても重複して送信されないようにする。
+    """
+
+    def __init__(self, access_token: str = None):
+        """
+        Parameters
+        ----------
+        access_token : str
+            チャネルアクセストークン
+        """
+        self.access_token = access_token
+
+    def _headers(self, retry_key: str = None):
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+        if retry_key:
+            headers['X-Line-Retry-Key'] = retry_key
+        return headers
+
+    def _request(self, path: str, retry_key: str = None, method: str = 'POST', **kwargs):
+        """レート制限と再試行を適用してリクエストを送信する
+
+        Parameters
+        ----------
+        path : str
+            APIのパス
+        retry_key : str
+            X-Line-Retry-Key（再試行しても同じ値を送る）
+        method : str
+            HTTPメソッド
+
+        Returns
+        -------
+        requests.Response
+            レスポンス
+        """
+        bucket = _buckets.get(path)
+        for attempt in range(LINE_MAX_RETRIES + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                response = session.request(method, f"{LINE_API_BASE_URL}{path}", **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == LINE_MAX_RETRIES:
+                    raise
+                print(f"{path} の送信に失敗しました（{attempt + 1}回目）:", e)
+                time.sleep(random.uniform(0, min(LINE_MAX_BACKOFF, 0.5 * (2 ** attempt))))
+                continue
+
+            # 同じ X-Line-Retry-Key のリクエストが受理済みの場合は成功とみなす
+            if retry_key and response.status_code == 409 and response.headers.get('x-line-accepted-request-id'):
+                return response
+            if response.status_code != 429 and response.status_code < 500:
+                break
+            if attempt == LINE_MAX_RETRIES:
+                break
+            wait = _retry_after(response)
+            if wait is not None and wait > LINE_MAX_BACKOFF:
+                # Lambdaのタイムアウトを超えて待たないよう、再試行せずにエラーにする
+                print(f"{path} の Retry-After が長すぎるため再試行しません（status={response.status_code}, retry_after={wait:.2f}s）")
+                break
+            if wait is None:
+                wait = random.uniform(0, min(LINE_MAX_BACKOFF, 0.5 * (2 ** attempt)))
+            print(f"{path} を再試行します（status={response.status_code}, wait={wait:.2f}s）")
+            time.sleep(wait)
+        if response.status_code == 401 and self.access_token:
+            print(f"{path} でアクセストークンが拒否されました")
+            for listener in _unauthorized_listeners:
+                listener(self.access_token)
+        response.raise_for_status()  # エラー時に例外を投げる
+        return response
+
+    def reply(self, reply_token: str, messages: list):
+        """応答メッセージを送信する
+
+        Parameters
+        ----------
+        reply_token : str
+            応答トークン
+        messages : list[dict]
+            送信するメッセージ
+
+        Returns
+        -------
+        requests.Response
+            レスポンス
+        """
+        return self._request(
+            '/v2/bot/message/reply',
+            headers=self._headers(),
+            json={
+                'replyToken': reply_token,
+                'messages': messages
+            }
+        )
+
+    def push(self, to: str, messages: list, retry_key: str = None):
+        """プッシュメッセージを送信する
+
+        Parameters
+        ----------
+        to : str
+            送信先のユーザーID
+        messages : list[dict]
+            送信するメッセージ
+        retry_key : str
+            X-Line-Retry-Key（省略時は新しく生成する）
+
+        Returns
+        -------
+        requests.Response
+            レスポンス
+        """
+        retry_key = retry_key or str(uuid.uuid4())
+        return self._request(
+            '/v2/bot/message/push',
+            retry_key=retry_key,
+            headers=self._headers(retry_key),
+            json={
+                'to': to,
+                'messages': messages
+            }
+        )
+
+    def multicast(self, to: list, messages: list, retry_key: str = None):
+        """複数のユーザーにメッセージを送信する
+
+        Parameters
+        ----------
+        to : list[str]
+            送信先のユーザーID（最大500件）
+        messages : list[dict]
+            送信するメッセージ
+        retry_key : str
+            X-Line-Retry-Key（省略時は新しく生成する）
+
+        Returns
+        -------
+        requests.Response
+            レスポンス
+        """
+        retry_key = retry_key or str(uuid.uuid4())
+        return self._request(
+            '/v2/bot/message/multicast',
+            retry_key=retry_key,
+            headers=self._headers(retry_key),
+            json={
+                'to': to,
+                'messages': messages
+            }
+        )
+
+    def get_quota(self):
+        """今月のメッセージ送信数の上限を取得する
+
+        Returns
+        -------
+        dict
+            type（none / limited）と value（上限数）を含むレスポンス
+        """
+        return self._request('/v2/bot/message/quota', method='GET', headers=self._headers()).json()
+
+    def get_quota_consumption(self):
+        """今月のメッセージ送信数を取得する
+
+        Returns
+        -------
+        dict
+            totalUsage（送信数）を含むレスポンス
+        """
+        return self._request('/v2/bot/message/quota/consumption', method='GET', headers=self._headers()).json()
+
+    def issue_token(self, channel_id: str, channel_secret: str):
+        """チャネルアクセストークンを発行する
+
+        Parameters
+        ----------
+        channel_id : str
+            チャネルID
+        channel_secret : str
+            チャネルシークレット
+
+        Returns
+        -------
+        dict
+            access_token と expires_in を含むレスポンス
+        """
+        response = self._request(
+            '/v2/oauth/accessToken',
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded'
+            },
+            data={
+                'grant_type': 'client_credentials',
+                'client_id': channel_id,
+                'client_secret': channel_secret
+            }
+        )
+        return response.json()
@@ -0,0 +1,41 @@
+import json
+import os
+import time
+
+
+# CloudWatchメトリクスの名前空間
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TicketBot')
+
+
+def put_metrics(metrics: dict, dimensions: dict = None, units: dict = None):
+    """CloudWatch Embedded Metric Format でメトリクスをログに出力する
+
+    ログに書き出すだけなので、CloudWatch APIの呼び出しは発生しない。
+
+    Parameters
+    ----------
+    metrics : dict
+        メトリクス名と値のマッピング
+    dimensions : dict
+        ディメンション名と値のマッピング
+    units : dict
+        メトリクス名と単位のマッピング（省略時は Count）
+    """
+    dimensions = dimensions or {}
+    units = units or {}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [
+                    {'Name': name, 'Unit': units.get(name, 'Count')}
+                    for name in metrics
+                ]
+            }]
+        },
+        **dimensions,
+        **metrics
+    }
+    print(json.dumps(record, ensure_ascii=False))
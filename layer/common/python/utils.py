@@ -1,12 +1,62 @@
 import boto3
-import requests
+import math
+import os
+import threading
 import time
+import uuid
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+from line_client import LineClient, add_unauthorized_listener, max_request_seconds
 
 
 dynamodb = boto3.resource('dynamodb')
 ssm = boto3.client('ssm')
 
 
+# まとめて取得するSSMパラメーター
+SSM_PARAMETER_NAMES = [
+    'TICKET_LINE_CHANNEL_ID',
+    'TICKET_LINE_CHANNEL_SECRET',
+    'TICKET_ADMIN_LINE_USER_ID',
+]
+# SSMパラメーターをキャッシュする秒数
+SSM_CACHE_TTL = int(os.environ.get('SSM_CACHE_TTL', '300'))
+
+# パラメーター名と、値・有効期限のマッピング
+_ssm_cache = {}
+_ssm_lock = threading.Lock()
+# SSMパラメーターのキャッシュのヒット数(hit)とミス数(miss)
+ssm_cache_stats = Counter()
+
+# 有効期限の何秒前までメモリにキャッシュしたアクセストークンを使うか
+TOKEN_MEMORY_MARGIN = int(os.environ.get('TOKEN_MEMORY_MARGIN', '60'))
+
+# メモリにキャッシュしたアクセストークンと有効期限
+_memory_token = {'access_token': None, 'expires_at': 0}
+_token_lock = threading.Lock()
+# アクセストークンのキャッシュのヒット数とミス数（memory_hit, dynamodb_miss など）
+token_cache_stats = Counter()
+
+# アクセストークンを更新する権利（リース）を保持する秒数。
+# 保持者の更新が終わる前に失効しないよう、トークン発行の再試行を含めた最大時間に余裕を足す
+TOKEN_LEASE_SECONDS = int(os.environ.get('TOKEN_LEASE_SECONDS', str(math.ceil(max_request_seconds()) + 5)))
+# 他の実行環境がアクセストークンを更新するのを待つ最大秒数（待っても更新されない場合はエラーにする）
+TOKEN_LEASE_WAIT = float(os.environ.get('TOKEN_LEASE_WAIT', '10'))
+# 他の実行環境の更新を待つ間隔（秒）
+TOKEN_LEASE_POLL_INTERVAL = 0.2
+
+# 有効期限まで何秒を切ったらアクセストークンをバックグラウンドで更新するか
+TOKEN_PREREFRESH_WINDOW = int(os.environ.get('TOKEN_PREREFRESH_WINDOW', '86400'))
+# バックグラウンドでの更新を再び試みるまでの最小間隔（秒）
+TOKEN_PREREFRESH_INTERVAL = int(os.environ.get('TOKEN_PREREFRESH_INTERVAL', '30'))
+
+# バックグラウンドで更新しているスレッドと開始時刻
+_prerefresh_state = {'thread': None, 'started_at': 0}
+_prerefresh_lock = threading.Lock()
+
 # RELIEF TICKETのURL
 base_url = 'https://relief-ticket.jp'
 
@@ -32,9 +82,32 @@ display_names = {
     'snowman': 'Snow Man',
 }
 
+def load_ssm_parameters(names: list = SSM_PARAMETER_NAMES):
+    """SSMパラメーターストアからパラメーターをまとめて取得し、キャッシュする
+
+    Parameters
+    ----------
+    names : list[str]
+        取得するパラメーターの名前（最大10件）
+    """
+    response = ssm.get_parameters(Names=list(names), WithDecryption=True)
+    print('load_ssm_parameters:', {
+        'loaded': [parameter['Name'] for parameter in response.get('Parameters', [])],
+        'invalid': response.get('InvalidParameters', [])
+    })
+    expires_at = time.monotonic() + SSM_CACHE_TTL
+    with _ssm_lock:
+        for parameter in response.get('Parameters', []):
+            _ssm_cache[parameter['Name']] = (parameter['Value'], expires_at)
+
+
 def get_ssm_parameter(name):
     """SSMパラメーターストアからパラメーターを取得する
 
+    取得した値は SSM_CACHE_TTL 秒間メモリにキャッシュし、
+    ウォームスタート時はSSMを呼び出さずに返す。
+    キャッシュにない場合は SSM_PARAMETER_NAMES をまとめて1回の GetParameters で取得する。
+
     Parameters
     ----------
     name : str
@@ -45,28 +118,106 @@ def get_ssm_parameter(name):
     str
         パラメーターの値
     """
+    with _ssm_lock:
+        cached = _ssm_cache.get(name)
+        if cached and cached[1] > time.monotonic():
+            ssm_cache_stats['hit'] += 1
+            return cached[0]
+        ssm_cache_stats['miss'] += 1
+
+    names = list(dict.fromkeys([name, *SSM_PARAMETER_NAMES]))
+    load_ssm_parameters(names)
+    with _ssm_lock:
+        cached = _ssm_cache.get(name)
+    if cached:
+        return cached[0]
+    # GetParameters で見つからない場合は、従来どおり例外を投げる
     response = ssm.get_parameter(Name=name, WithDecryption=True)
-    print('get_ssm_parameter response:', response)
     return response['Parameter']['Value']
 
 
-def get_cached_token():
-    """キャッシュされたアクセストークンを取得する
+def _promote_token(access_token: str, expires_at: int):
+    """アクセストークンをメモリのキャッシュに載せる"""
+    with _token_lock:
+        _memory_token.update(access_token=access_token, expires_at=expires_at)
+
+
+def _demote_token():
+    """メモリのキャッシュからアクセストークンを外す"""
+    with _token_lock:
+        _memory_token.update(access_token=None, expires_at=0)
+
+
+def invalidate_token(access_token: str = None):
+    """メモリのキャッシュを破棄し、次回は DynamoDB から読み直す
+
+    LINE Messaging API が 401 を返した場合に LineClient から呼び出される。
+
+    Parameters
+    ----------
+    access_token : str
+        拒否されたアクセストークン（指定した場合は、メモリのトークンと一致するときだけ破棄する）
+    """
+    with _token_lock:
+        if access_token is not None and _memory_token['access_token'] != access_token:
+            return
+        _memory_token.update(access_token=None, expires_at=0)
+    print('Token invalidated')
+
+
+# LINE Messaging API が 401 を返したら、拒否されたトークンをメモリから外す
+add_unauthorized_listener(invalidate_token)
+
+
+def get_memory_token():
+    """メモリにキャッシュされたアクセストークンを取得する
+
+    有効期限の TOKEN_MEMORY_MARGIN 秒前を過ぎたトークンはメモリから外す。
 
     Returns
     -------
     str
-        キャッシュされたアクセストークン or None
+        メモリにキャッシュされたアクセストークン or None
     """
-    table = dynamodb.Table('TicketAccessTokenCache')
-    response = table.get_item(Key={'token_type': 'channel_access_token'})
-    print('get_cached_token response:', response)
+    with _token_lock:
+        access_token = _memory_token['access_token']
+        expires_at = _memory_token['expires_at']
+        fresh = bool(access_token) and expires_at - TOKEN_MEMORY_MARGIN > time.time()
+        token_cache_stats['memory_hit' if fresh else 'memory_miss'] += 1
+    if fresh:
+        return access_token
+    if access_token:
+        _demote_token()
+    return None
+
+
+def _read_token_item(consistent_read: bool = False):
+    """DynamoDB から有効期限内のアクセストークンを読み込む（ヒット数には数えない）"""
+    response = dynamodb.meta.client.get_item(
+        TableName='TicketAccessTokenCache',
+        Key={'token_type': 'channel_access_token'},
+        ConsistentRead=consistent_read
+    )
     item = response.get('Item')
-    if item and item['expires_at'] > int(time.time()):
-        return item['access_token']
+    if item and item.get('access_token') and item.get('expires_at', 0) > int(time.time()):
+        return item
     return None
 
 
+def get_cached_token():
+    """DynamoDB にキャッシュされたアクセストークンを取得する
+
+    Returns
+    -------
+    dict
+        アクセストークン(access_token)と有効期限(expires_at)を含むアイテム or None
+    """
+    item = _read_token_item()
+    with _token_lock:
+        token_cache_stats['dynamodb_hit' if item else 'dynamodb_miss'] += 1
+    return item
+
+
 def fetch_new_token(channel_id: str, channel_secret: str):
     """新しいアクセストークンを取得し、キャッシュに保存する
 
@@ -79,40 +230,212 @@ def fetch_new_token(channel_id: str, channel_secret: str):
 
     Returns
     -------
-    str
-        新しいアクセストークン
+    dict
+        アクセストークン(access_token)と有効期限(expires_at)を含むアイテム
     """
-    url = "https://api.line.me/v2/oauth/accessToken"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": channel_id,
-        "client_secret": channel_secret
-    }
-    response = requests.post(url, headers=headers, data=data)
-    response.raise_for_status()  # エラー時に例外を投げる
-    print('fetch_new_token response:', response.json())
-    token_info = response.json()
+    token_info = LineClient().issue_token(channel_id, channel_secret)
+    print('fetch_new_token expires_in:', token_info['expires_in'])
     access_token = token_info['access_token']
     expires_in = token_info['expires_in']
 
-    # キャッシュに保存
-    table = dynamodb.Table('TicketAccessTokenCache')
+    # キャッシュに保存（リースの属性を含めずに上書きするため、リースも解放される）
     item = {
         'token_type': 'channel_access_token',
         'access_token': access_token,
         'expires_at': int(time.time()) + expires_in - 30
     }
-    table.put_item(Item=item)
-    print('Token cached:', item)
-    return access_token
+    dynamodb.meta.client.put_item(TableName='TicketAccessTokenCache', Item=item)
+    print('Token cached:', {'expires_at': item['expires_at']})
+    return item
+
+
+def is_conditional_check_failed(e: ClientError):
+    """条件付き書き込みの条件を満たさなかったことによる例外かを判定する"""
+    return e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def acquire_refresh_lease(owner: str):
+    """アクセストークンを更新するリースを取得する
+
+    キャッシュのアイテムにリースの保持者と期限を条件付きで書き込み、
+    他の実行環境がリースを保持していない場合だけ成功する。
+    リースは TOKEN_LEASE_SECONDS 秒で失効するため、保持者が異常終了しても他が引き継げる。
+
+    Parameters
+    ----------
+    owner : str
+        リースの保持者を識別する値
+
+    Returns
+    -------
+    bool
+        リースを取得できたか
+    """
+    now = int(time.time())
+    try:
+        dynamodb.meta.client.update_item(
+            TableName='TicketAccessTokenCache',
+            Key={'token_type': 'channel_access_token'},
+            UpdateExpression='SET lease_owner = :owner, lease_expires_at = :lease_expires_at',
+            ConditionExpression='attribute_not_exists(lease_expires_at) OR lease_expires_at < :now',
+            ExpressionAttributeValues={
+                ':owner': owner,
+                ':lease_expires_at': now + TOKEN_LEASE_SECONDS,
+                ':now': now
+            }
+        )
+        return True
+    except ClientError as e:
+        if is_conditional_check_failed(e):
+            return False
+        raise
+
+
+def release_refresh_lease(owner: str):
+    """保持しているリースを解放する
+
+    Parameters
+    ----------
+    owner : str
+        リースの保持者を識別する値
+    """
+    try:
+        dynamodb.meta.client.update_item(
+            TableName='TicketAccessTokenCache',
+            Key={'token_type': 'channel_access_token'},
+            UpdateExpression='REMOVE lease_owner, lease_expires_at',
+            ConditionExpression='lease_owner = :owner',
+            ExpressionAttributeValues={':owner': owner}
+        )
+    except ClientError as e:
+        if not is_conditional_check_failed(e):
+            raise
+
+
+def refresh_token(channel_id: str, channel_secret: str, current_item: dict = None):
+    """リースを取得した1つの実行環境だけがアクセストークンを更新する
+
+    リースを取得できた場合も、直前に他の実行環境が更新していればそのトークンを使う。
+    リースを取得できなかった場合、まだ有効な current_item があればそれを使い、
+    なければ他の実行環境が更新したトークンを TOKEN_LEASE_WAIT 秒まで待つ。
+    待っても更新されない場合は、トークンの発行が集中しないよう自分では発行せずにエラーにする
+    （保持者が異常終了した場合は、リースが失効した後の呼び出しで更新される）。
+
+    Parameters
+    ----------
+    channel_id : str
+        チャネルID
+    channel_secret : str
+        チャネルシークレット
+    current_item : dict
+        現在キャッシュされているアイテム（有効期限内であれば更新中に使い続ける）
+
+    Returns
+    -------
+    dict
+        アクセストークン(access_token)と有効期限(expires_at)を含むアイテム
+    """
+    owner = str(uuid.uuid4())
+    # これより有効期限が先のトークンがあれば、他の実行環境が更新済みとみなす
+    known_expires_at = current_item['expires_at'] if current_item else 0
+    deadline = time.time() + TOKEN_LEASE_WAIT
+    while True:
+        if acquire_refresh_lease(owner):
+            print('Refresh lease acquired')
+            try:
+                item = _read_token_item(consistent_read=True)
+                if item and item['expires_at'] > known_expires_at:
+                    print('Token was refreshed elsewhere just before the lease')
+                    release_refresh_lease(owner)
+                    return item
+                return fetch_new_token(channel_id, channel_secret)
+            except Exception:
+                release_refresh_lease(owner)
+                raise
+
+        if current_item and current_item['expires_at'] > int(time.time()):
+            print('Token is being refreshed elsewhere, using current token')
+            return current_item
+        if time.time() >= deadline:
+            break
+        time.sleep(TOKEN_LEASE_POLL_INTERVAL)
+        item = _read_token_item(consistent_read=True)
+        if item and item['expires_at'] > known_expires_at:
+            print('Using token refreshed elsewhere')
+            return item
+
+    raise RuntimeError(f"アクセストークンの更新を {TOKEN_LEASE_WAIT} 秒待ちましたが、完了しませんでした")
+
+
+def _hit_rate(tier: str):
+    with _token_lock:
+        hit = token_cache_stats[f'{tier}_hit']
+        total = hit + token_cache_stats[f'{tier}_miss']
+    return round(hit / total, 3) if total else None
+
+
+def _needs_prerefresh(expires_at: int):
+    """有効期限まで TOKEN_PREREFRESH_WINDOW 秒を切っているかを判定する"""
+    return expires_at - TOKEN_PREREFRESH_WINDOW <= time.time()
+
+
+def _prerefresh(channel_id: str, channel_secret: str):
+    """アクセストークンを事前に更新し、メモリに載せる"""
+    try:
+        # 他の実行環境が更新済みであれば、それを使う
+        item = _read_token_item(consistent_read=True)
+        if not item or _needs_prerefresh(item['expires_at']):
+            item = refresh_token(channel_id, channel_secret, item)
+        _promote_token(item['access_token'], int(item['expires_at']))
+        print('Token pre-refreshed:', {'expires_at': item['expires_at']})
+    except Exception as e:
+        # 現在のトークンはまだ有効なため、次の機会に再び試みる
+        print('アクセストークンの事前更新に失敗しました:', e)
+
+
+def schedule_prerefresh(channel_id: str, channel_secret: str, expires_at: int):
+    """有効期限が近い場合にアクセストークンをバックグラウンドで更新する
+
+    更新は1つのスレッドだけで行い、TOKEN_PREREFRESH_INTERVAL 秒以内には再び開始しない。
+
+    Parameters
+    ----------
+    channel_id : str
+        チャネルID
+    channel_secret : str
+        チャネルシークレット
+    expires_at : int
+        現在のアクセストークンの有効期限
+
+    Returns
+    -------
+    bool
+        更新を開始したか
+    """
+    if not _needs_prerefresh(expires_at):
+        return False
+    with _prerefresh_lock:
+        thread = _prerefresh_state['thread']
+        if thread is not None and thread.is_alive():
+            return False
+        if time.time() - _prerefresh_state['started_at'] < TOKEN_PREREFRESH_INTERVAL:
+            return False
+        thread = threading.Thread(target=_prerefresh, args=(channel_id, channel_secret), daemon=True)
+        _prerefresh_state.update(thread=thread, started_at=time.time())
+    print('Starting token pre-refresh:', {'expires_at': expires_at})
+    thread.start()
+    return True
 
 
 def get_token(channel_id: str, channel_secret: str):
     """アクセストークンを取得する
 
+    メモリ、DynamoDB の順にキャッシュを探し、どちらにもなければ新しく発行する。
+    発行はリースを取得した1つの実行環境だけが行い、他はその結果を待つ。
+    DynamoDB から読んだトークンと新しく発行したトークンはメモリに載せる。
+    有効期限まで TOKEN_PREREFRESH_WINDOW 秒を切っている場合は、
+    現在のトークンを返しつつバックグラウンドで更新する。
+
     Parameters
     ----------
     channel_id : str
@@ -125,10 +448,38 @@ def get_token(channel_id: str, channel_secret: str):
     str
         アクセストークン
     """
-    cached_token = get_cached_token()
-    if cached_token:
+    access_token = get_memory_token()
+    if access_token:
+        with _token_lock:
+            expires_at = _memory_token['expires_at']
+        schedule_prerefresh(channel_id, channel_secret, expires_at)
+        return access_token
+
+    item = get_cached_token()
+    if item:
         print('Using cached token')
-        return cached_token
     else:
         print('Fetching new token')
-        return fetch_new_token(channel_id, channel_secret)
+        item = refresh_token(channel_id, channel_secret)
+    _promote_token(item['access_token'], int(item['expires_at']))
+    print('token cache hit rate:', {'memory': _hit_rate('memory'), 'dynamodb': _hit_rate('dynamodb')})
+    schedule_prerefresh(channel_id, channel_secret, int(item['expires_at']))
+    return item['access_token']
+
+
+def prepare_token():
+    """初期化フェーズでアクセストークンをメモリに載せる
+
+    Lambda の初期化時に呼び出し、最初のリクエストで DynamoDB の読み込みや
+    トークンの発行を待たないようにする。失敗してもリクエスト時に改めて取得するため、例外は投げない。
+
+    Returns
+    -------
+    str
+        アクセストークン or None
+    """
+    try:
+        return get_token(get_ssm_parameter('TICKET_LINE_CHANNEL_ID'), get_ssm_parameter('TICKET_LINE_CHANNEL_SECRET'))
+    except Exception as e:
+        print('初期化時にアクセストークンを取得できませんでした:', e)
+        return None
@@ -0,0 +1,189 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+import boto3
+import pytest
+import requests
+from moto import mock_aws
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+# Lambda と同じく、共通レイヤーと関数のディレクトリを直接 import できるようにする
+sys.path.insert(0, os.path.join(ROOT, 'layer', 'common', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'lambda-python3.13', 'check_ticket'))
+
+# モジュールの読み込み時に boto3 のクライアントを作るため、リージョンと認証情報を設定する
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+def read_fixture(name: str):
+    """テスト用に保存したページのバイト列を読み込む"""
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+@contextlib.contextmanager
+def function_modules(function: str, names: tuple):
+    """別の Lambda 関数のモジュールを、同じ名前のモジュールと衝突しないように読み込む
+
+    check_ticket と push_notification はどちらも app や dispatcher を持つため、
+    読み込んでいる間だけ sys.modules と sys.path を入れ替える。
+    """
+    saved = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+    sys.path.insert(0, os.path.join(ROOT, 'lambda-python3.13', function))
+    try:
+        yield
+    finally:
+        sys.path.remove(os.path.join(ROOT, 'lambda-python3.13', function))
+        for name in names:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+
+
+# テストで使う DynamoDB テーブルのキー
+TABLES = {
+    'TicketBotUsers': {
+        'KeySchema': [{'AttributeName': 'userId', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'userId', 'AttributeType': 'S'}]
+    },
+    'TicketBotLastNotify': {
+        'KeySchema': [
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'artist', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'artist', 'AttributeType': 'S'}
+        ]
+    },
+    'TicketAccessTokenCache': {
+        'KeySchema': [{'AttributeName': 'token_type', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'token_type', 'AttributeType': 'S'}]
+    },
+    'TicketBotArtistCooldown': {
+        'KeySchema': [
+            {'AttributeName': 'artist', 'KeyType': 'HASH'},
+            {'AttributeName': 'shard', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'artist', 'AttributeType': 'S'},
+            {'AttributeName': 'shard', 'AttributeType': 'N'}
+        ]
+    },
+}
+
+
+def create_table(name: str):
+    """moto に DynamoDB テーブルを作成する"""
+    boto3.client('dynamodb').create_table(TableName=name, BillingMode='PAY_PER_REQUEST', **TABLES[name])
+    return boto3.resource('dynamodb').Table(name)
+
+
+@pytest.fixture
+def aws():
+    """AWS の呼び出しを moto に向ける"""
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def last_notify_table(aws, monkeypatch):
+    """TicketBotLastNotify を作成し、cooldown のリソースを moto に向け直す"""
+    import cooldown
+    table = create_table('TicketBotLastNotify')
+    # モジュールの読み込み時に作られたリソースを moto に向け直す
+    monkeypatch.setattr(cooldown, 'dynamodb', boto3.resource('dynamodb'))
+    return table
+
+
+@pytest.fixture
+def artist_cooldown_table(aws, monkeypatch):
+    """TicketBotArtistCooldown を作成し、cooldown のリソースを moto に向け直す"""
+    import cooldown
+    table = create_table('TicketBotArtistCooldown')
+    monkeypatch.setattr(cooldown, 'dynamodb', boto3.resource('dynamodb'))
+    return table
+
+
+@pytest.fixture
+def token_cache_table(aws, monkeypatch):
+    """TicketAccessTokenCache を作成し、utils のリソースを moto に向け直す"""
+    import utils
+    table = create_table('TicketAccessTokenCache')
+    monkeypatch.setattr(utils, 'dynamodb', boto3.resource('dynamodb'))
+    return table
+
+
+@pytest.fixture
+def users_table(aws):
+    """TicketBotUsers を作成する"""
+    return create_table('TicketBotUsers')
+
+
+class FakeSite:
+    """URLごとに保存したページを返す session の代わり
+
+    ETag を指定したページは If-None-Match が一致すると 304 を返す。
+    リクエストの回数とホストごとの最大同時リクエスト数を記録する。
+    """
+
+    def __init__(self, pages: dict = None, delay: float = 0):
+        """
+        Parameters
+        ----------
+        pages : dict
+            URLと、レスポンスボディ(content)・ヘッダー(headers)・ステータス(status)のマッピング
+        delay : float
+            1リクエストにかかる秒数
+        """
+        self.pages = dict(pages or {})
+        self.delay = delay
+        self.requests = []
+        self.max_in_flight = {}
+        self._in_flight = collections.Counter()
+        self._lock = threading.Lock()
+
+    def serve(self, url: str, content: bytes, content_type: str = 'text/html; charset=utf-8', etag: str = None, status: int = 200):
+        headers = {'Content-Type': content_type}
+        if etag:
+            headers['ETag'] = etag
+        self.pages[url] = {'content': content, 'headers': headers, 'status': status}
+
+    def get(self, url, headers=None, **kwargs):
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            self.requests.append((url, dict(headers or {})))
+            self._in_flight[host] += 1
+            self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self._in_flight[host])
+        try:
+            time.sleep(self.delay)
+            page = self.pages.get(url, {'content': b'', 'headers': {}, 'status': 404})
+            response = requests.Response()
+            response.url = url
+            etag = page['headers'].get('ETag')
+            if etag and (headers or {}).get('If-None-Match') == etag:
+                response.status_code = 304
+                response.headers.update({'ETag': etag})
+                response._content = b''
+            else:
+                response.status_code = page['status']
+                response.headers.update(page['headers'])
+                response._content = page['content']
+            # ボディは読み込み済みとして扱い、stream=True でも iter_content で返す
+            response._content_consumed = True
+            return response
+        finally:
+            with self._lock:
+                self._in_flight[host] -= 1
+
+    def urls(self):
+        return [url for url, _ in self.requests]
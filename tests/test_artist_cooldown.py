@@ -0,0 +1,45 @@
+import cooldown
+
+
+USERS = [f'U{i:032d}' for i in range(10)]
+NOW = 1760000000
+
+
+def limit_for(users: int):
+    """指定したユーザー数だけ入るシャードの上限サイズ"""
+    return cooldown.estimate_shard_size('news', {user_id: NOW for user_id in USERS[:users]})
+
+
+def test_select_skips_users_that_do_not_fit(artist_cooldown_table, monkeypatch):
+    monkeypatch.setattr(cooldown, 'COOLDOWN_SHARD_MAX_BYTES', limit_for(3))
+    first = cooldown.ArtistCooldown('news', NOW, shards=1)
+
+    selected = first.select(USERS)
+    assert len(selected) == 3
+
+    # 送信後の記録は上限に収まり、例外にならない
+    first.commit(list(selected), [])
+    assert cooldown.ArtistCooldown('news', NOW, shards=1).select(list(selected)) == set()
+
+
+def test_expired_entries_free_space(artist_cooldown_table, monkeypatch):
+    monkeypatch.setattr(cooldown, 'COOLDOWN_SHARD_MAX_BYTES', limit_for(3))
+    first = cooldown.ArtistCooldown('news', NOW, shards=1)
+    first.commit(list(first.select(USERS)), [])
+
+    later = cooldown.ArtistCooldown('news', NOW + cooldown.COOLDOWN_SECONDS, shards=1)
+
+    assert len(later.select(USERS)) == 3
+
+
+def test_concurrent_overflow_drops_oldest_instead_of_failing(artist_cooldown_table, monkeypatch):
+    monkeypatch.setattr(cooldown, 'COOLDOWN_SHARD_MAX_BYTES', limit_for(3))
+    first = cooldown.ArtistCooldown('news', NOW, shards=1)
+    second = cooldown.ArtistCooldown('news', NOW + 1, shards=1)
+    first_selected = first.select(USERS[:3])
+    second_selected = second.select(USERS[3:6])
+
+    first.commit(list(first_selected), [])
+    second.commit(list(second_selected), [])
+
+    assert cooldown.ArtistCooldown('news', NOW + 1, shards=1).select(USERS[3:6]) == set()
@@ -0,0 +1,93 @@
+import pytest
+import requests
+
+import crawler
+from conftest import read_fixture
+from extractors import SoupExtractor, may_have_buy_button
+from page_cache import PageCache
+
+
+# ページと、そのページのエンコーディング
+PAGES = [
+    ('event_available.html', 'utf-8'),
+    ('event_sold_out.html', 'utf-8'),
+    ('event_available_sjis.html', 'shift_jis'),
+    ('event_multiple_sections.html', 'utf-8'),
+]
+
+
+def precheck_then_parse(content: bytes, encoding: str):
+    """crawler と同じく、マーカーがなければ解析せずに空の結果を返す"""
+    if not may_have_buy_button(content, encoding):
+        return []
+    return SoupExtractor().performs(content.decode(encoding))
+
+
+def available(performs: list):
+    return [perform for perform in performs if perform['available']]
+
+
+@pytest.mark.parametrize('name, encoding', PAGES)
+def test_precheck_keeps_every_available_perform(name, encoding):
+    content = read_fixture(name)
+    full = SoupExtractor(restricted=False).performs(content.decode(encoding))
+
+    assert available(precheck_then_parse(content, encoding)) == available(full)
+
+
+def test_precheck_skips_sold_out_page():
+    content = read_fixture('event_sold_out.html')
+
+    assert not may_have_buy_button(content, 'utf-8')
+
+
+def test_marker_is_encoded_with_page_encoding():
+    content = read_fixture('event_sold_out.html').decode('utf-8').replace('受付終了', '購入手続きへ').encode('shift_jis')
+
+    assert may_have_buy_button(content, 'shift_jis')
+    assert not may_have_buy_button(read_fixture('event_sold_out.html').decode('utf-8').encode('shift_jis'), 'shift_jis')
+
+
+def test_unencodable_marker_does_not_skip():
+    assert may_have_buy_button(b'<html></html>', 'ascii')
+
+
+class FakeSession:
+    """保存したページを返す session の代わり"""
+
+    def __init__(self, content: bytes, content_type: str):
+        self.content = content
+        self.content_type = content_type
+
+    def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = self.content_type
+        response._content = self.content
+        return response
+
+
+def test_crawler_prechecks_with_response_encoding(monkeypatch, tmp_path):
+    content = read_fixture('event_available_sjis.html')
+    monkeypatch.setattr(crawler, 'session', FakeSession(content, 'text/html; charset=Shift_JIS'))
+    c = crawler.Crawler(cache=PageCache(str(tmp_path / 'cache.json')), extractor=SoupExtractor())
+
+    performs = c._crawl_event('events/1')
+
+    assert available(performs) == [{'date': '2025/10/04(土) 17:00', 'place': 'バンテリンドーム ナゴヤ', 'available': True}]
+
+
+def test_crawler_parses_page_with_charset_only_in_markup(monkeypatch, tmp_path):
+    content = read_fixture('event_available_sjis.html')
+    monkeypatch.setattr(crawler, 'session', FakeSession(content, 'text/html'))
+    c = crawler.Crawler(cache=PageCache(str(tmp_path / 'cache.json')), extractor=SoupExtractor())
+
+    performs = c._crawl_event('events/1')
+
+    assert available(performs) == [{'date': '2025/10/04(土) 17:00', 'place': 'バンテリンドーム ナゴヤ', 'available': True}]
+
+
+def test_precheck_does_not_skip_body_invalid_in_checked_encoding():
+    content = read_fixture('event_available_sjis.html')
+
+    assert may_have_buy_button(content, 'utf-8')
@@ -0,0 +1,52 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def app(last_notify_table, monkeypatch):
+    app = importlib.import_module('app')
+
+    class FakeLineClient:
+        def __init__(self, token=None):
+            pass
+
+        def push(self, to, messages, retry_key=None):
+            return type('Response', (), {'json': lambda self: {}})()
+
+    monkeypatch.setattr(app, 'get_token', lambda channel_id, channel_secret: 'token')
+    monkeypatch.setattr(app, 'get_ssm_parameter', lambda name: name)
+    monkeypatch.setattr(app, 'LineClient', FakeLineClient)
+    monkeypatch.setattr(app, 'plan_notifications', lambda client, notifications: (notifications, []))
+    monkeypatch.setattr(app.crawler, 'crawl', lambda artists: {
+        'news': [{'date': '2025/08/01(金) 18:00', 'place': '東京ドーム', 'url': 'https://relief-ticket.jp/events/1'}]
+    })
+    return app
+
+
+USERS = [f'U{i:032d}' for i in range(120)]
+
+
+def test_failed_send_does_not_leave_claims(app, monkeypatch):
+    monkeypatch.setattr(app, 'iter_subscribers', lambda artist: iter(USERS))
+
+    def broken_multicast(token, user_ids, messages):
+        raise ValueError('unexpected')
+
+    monkeypatch.setattr(app, 'multicast', broken_multicast)
+    assert app.lambda_handler({}, None)['statusCode'] == 500
+
+    sent = []
+
+    def multicast(token, user_ids, messages):
+        sent.extend(user_ids)
+        return list(user_ids), []
+
+    monkeypatch.setattr(app, 'multicast', multicast)
+    assert app.lambda_handler({}, None)['statusCode'] == 200
+    assert sorted(sent) == USERS
+
+    # 送信に成功したユーザーはクールダウンに入る
+    sent.clear()
+    app.lambda_handler({}, None)
+    assert sent == []
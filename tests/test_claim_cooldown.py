@@ -0,0 +1,54 @@
+import cooldown
+
+
+USERS = ['u1', 'u2', 'u3']
+
+
+def test_claim_blocks_overlapping_run(last_notify_table):
+    first = cooldown.ClaimCooldown('news', 1000)
+    second = cooldown.ClaimCooldown('news', 1000)
+
+    assert first.select(USERS) == set(USERS)
+    assert second.select(USERS) == set()
+
+
+def test_epoc_time_is_written_only_after_send(last_notify_table):
+    claim = cooldown.ClaimCooldown('news', 1000)
+    claim.select(USERS)
+
+    assert 'EpocTime' not in last_notify_table.get_item(Key={'userId': 'u1', 'artist': 'news'})['Item']
+
+    claim.commit(['u1'], ['u2'])
+    claim.abort()
+
+    assert last_notify_table.get_item(Key={'userId': 'u1', 'artist': 'news'})['Item']['EpocTime'] == 1000
+    # 確定したユーザーだけがクールダウンに入る
+    assert cooldown.ClaimCooldown('news', 1000).select(USERS) == {'u2', 'u3'}
+
+
+def test_abort_releases_unsent_claims(last_notify_table):
+    claim = cooldown.ClaimCooldown('news', 1000)
+    claim.select(USERS)
+
+    claim.abort()
+
+    assert cooldown.ClaimCooldown('news', 1000).select(USERS) == set(USERS)
+
+
+def test_expired_lease_can_be_claimed_again(last_notify_table):
+    # 送信前にタイムアウトした（abort も呼ばれなかった）場合
+    cooldown.ClaimCooldown('news', 1000).select(USERS)
+
+    assert cooldown.ClaimCooldown('news', 1000 + cooldown.COOLDOWN_CLAIM_LEASE_SECONDS - 1).select(USERS) == set()
+    assert cooldown.ClaimCooldown('news', 1000 + cooldown.COOLDOWN_CLAIM_LEASE_SECONDS + 1).select(USERS) == set(USERS)
+
+
+def test_claim_extends_expired_ttl_of_returning_user(last_notify_table):
+    # 前回の通知から時間が経ち、TTL の期限も過ぎている（まだ削除されていない）行
+    last_notify_table.put_item(Item={'userId': 'u1', 'artist': 'news', 'EpocTime': 1000, 'ExpiresAt': 1000 + cooldown.COOLDOWN_SECONDS})
+    now = 1000 + cooldown.COOLDOWN_SECONDS * 2
+
+    assert cooldown.ClaimCooldown('news', now).select(['u1']) == {'u1'}
+
+    item = last_notify_table.get_item(Key={'userId': 'u1', 'artist': 'news'})['Item']
+    assert item['ExpiresAt'] >= item['ClaimedUntil'] > now
@@ -0,0 +1,73 @@
+from bs4 import BeautifulSoup
+import pytest
+
+import crawler
+from conftest import FakeSite, read_fixture
+from extractors import SoupExtractor
+from page_cache import PageCache
+from utils import base_url
+
+
+ARTISTS = {'news': 101, 'snowman': 102}
+
+EVENT_PAGES = {
+    'events/detail/101': ('event_available.html', 'text/html; charset=utf-8'),
+    'events/detail/102': ('event_sold_out.html', 'text/html; charset=utf-8'),
+    'events/detail/103': ('event_available_sjis.html', 'text/html; charset=Shift_JIS'),
+    'events/detail/104': ('event_multiple_sections.html', 'text/html; charset=utf-8'),
+}
+
+
+def build_site(delay: float = 0):
+    site = FakeSite(delay=delay)
+    site.serve(f"{base_url}/events/artist/101", read_fixture('artist_news.html'))
+    site.serve(f"{base_url}/events/artist/102", read_fixture('artist_snowman.html'))
+    for event_url, (name, content_type) in EVENT_PAGES.items():
+        site.serve(f"{base_url}/{event_url}", read_fixture(name), content_type)
+    return site
+
+
+def sequential_available_tickets(site: FakeSite, artists: dict):
+    """並行化する前の check_ticket と同じ手順で、1ページずつ空き状況を取得する"""
+    artist_available_tickets = {}
+    for artist_name, artist_id in artists.items():
+        artist_available_tickets[artist_name] = []
+        artist_soup = BeautifulSoup(site.get(f"{base_url}/events/artist/{artist_id}").text, 'html.parser')
+        for event in artist_soup.find_all('a', {'class': 'd-block'}):
+            event_url = event.get('href')
+            if not event_url:
+                continue
+            event_soup = BeautifulSoup(site.get(f"{base_url}/{event_url}").text, 'html.parser')
+            for perform in event_soup.find_all('div', {'class': 'perform-list'}):
+                if perform.find('button', {'class': 'btn'}):
+                    artist_available_tickets[artist_name].append({
+                        'date': perform.find('div', {'class': 'lead'}).text,
+                        'place': perform.find('p').text,
+                        'url': f"{base_url}/{event_url}"
+                    })
+    return artist_available_tickets
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_crawl_matches_sequential_order(monkeypatch, tmp_path, streaming):
+    site = build_site()
+    monkeypatch.setattr(crawler, 'session', site)
+    c = crawler.Crawler(max_workers=8, max_per_host=4, cache=PageCache(str(tmp_path / 'cache.json')), extractor=SoupExtractor(), streaming=streaming)
+
+    expected = sequential_available_tickets(build_site(), ARTISTS)
+
+    assert c.crawl(ARTISTS) == expected
+    # 空きのある公演がアーティスト・イベント・公演の順に複数並ぶことを確認する
+    assert [ticket['url'].rsplit('/', 1)[-1] for ticket in expected['news']] == sorted(ticket['url'].rsplit('/', 1)[-1] for ticket in expected['news'])
+    assert len(expected['news']) > 1 and expected['snowman']
+
+
+def test_crawl_respects_max_per_host(monkeypatch, tmp_path):
+    site = build_site(delay=0.05)
+    monkeypatch.setattr(crawler, 'session', site)
+    c = crawler.Crawler(max_workers=8, max_per_host=2, cache=PageCache(str(tmp_path / 'cache.json')), extractor=SoupExtractor())
+
+    c.crawl(ARTISTS)
+
+    assert site.max_in_flight == {'relief-ticket.jp': 2}
+    assert sorted(set(site.urls())) == sorted(site.pages)
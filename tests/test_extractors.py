@@ -0,0 +1,38 @@
+import pytest
+
+from conftest import read_fixture
+from extractors import RegexExtractor, SoupExtractor
+
+
+RAW_TEXT_PAGE = (
+    '<div class="perform-list"><div class="lead">2025/10/04(土) 17:00</div>'
+    '<p>X</p><script>var s="<div>";</script></div>'
+    '<div class="perform-list"><div class="lead">2025/10/05(日) 17:00</div>'
+    '<p>Y</p><style>p::after { content: "</p><div>"; }</style>'
+    '<textarea><button class="btn"></textarea><button class="btn">購入手続きへ</button></div>'
+)
+
+
+@pytest.mark.parametrize('name,encoding', [
+    ('event_available.html', 'utf-8'),
+    ('event_sold_out.html', 'utf-8'),
+    ('event_available_sjis.html', 'shift_jis'),
+    ('event_multiple_sections.html', 'utf-8'),
+])
+def test_regex_matches_soup(name, encoding):
+    html = read_fixture(name).decode(encoding)
+
+    assert RegexExtractor().performs(html) == SoupExtractor().performs(html)
+
+
+def test_regex_skips_tags_in_raw_text_elements():
+    performs = RegexExtractor().performs(RAW_TEXT_PAGE)
+
+    assert performs == SoupExtractor().performs(RAW_TEXT_PAGE)
+    assert [perform['available'] for perform in performs] == [False, True]
+
+
+def test_regex_ignores_links_in_scripts():
+    html = '<script>document.write(\'<a class="d-block" href="events/detail/0">\');</script><a class="d-block" href="events/detail/1">'
+
+    assert RegexExtractor().event_links(html) == SoupExtractor().event_links(html) == ['events/detail/1']
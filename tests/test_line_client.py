@@ -0,0 +1,63 @@
+import requests
+
+import line_client
+
+
+class FakeSession:
+    """決まったレスポンスを順に返す session の代わり"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def response(status_code: int, headers: dict = None):
+    res = requests.Response()
+    res.status_code = status_code
+    res.headers.update(headers or {})
+    res._content = b'{}'
+    return res
+
+
+def test_long_retry_after_fails_fast(monkeypatch):
+    session = FakeSession(response(429, {'Retry-After': '60'}), response(200))
+    monkeypatch.setattr(line_client, 'session', session)
+    monkeypatch.setattr(line_client.time, 'sleep', lambda seconds: (_ for _ in ()).throw(AssertionError('slept')))
+
+    try:
+        line_client.LineClient('token').push('U1', [])
+    except requests.HTTPError as e:
+        assert e.response.status_code == 429
+    else:
+        raise AssertionError('HTTPError was not raised')
+    assert session.calls == 1
+
+
+def test_short_retry_after_is_followed(monkeypatch):
+    session = FakeSession(response(429, {'Retry-After': '1'}), response(200))
+    slept = []
+    monkeypatch.setattr(line_client, 'session', session)
+    monkeypatch.setattr(line_client.time, 'sleep', slept.append)
+
+    assert line_client.LineClient('token').push('U1', []).status_code == 200
+    assert slept == [1.0]
+
+
+def test_unauthorized_notifies_listeners(monkeypatch):
+    session = FakeSession(response(401))
+    rejected = []
+    monkeypatch.setattr(line_client, 'session', session)
+    monkeypatch.setattr(line_client, '_unauthorized_listeners', [rejected.append])
+
+    try:
+        line_client.LineClient('revoked').push('U1', [])
+    except requests.HTTPError as e:
+        assert e.response.status_code == 401
+    else:
+        raise AssertionError('HTTPError was not raised')
+    assert rejected == ['revoked']
+    assert session.calls == 1
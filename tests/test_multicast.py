@@ -0,0 +1,27 @@
+import dispatcher
+
+
+class FakeLineClient:
+    """2番目のチャンクだけ requests 以外の例外を投げる LineClient の代わり"""
+
+    sent = []
+
+    def __init__(self, token):
+        pass
+
+    def multicast(self, to, messages, retry_key=None):
+        if to[0] == 'u500':
+            raise ValueError('unexpected')
+        FakeLineClient.sent.append(list(to))
+
+
+def test_unexpected_error_fails_only_its_chunk(monkeypatch):
+    monkeypatch.setattr(dispatcher, 'LineClient', FakeLineClient)
+    FakeLineClient.sent = []
+    user_ids = [f'u{i}' for i in range(1200)]
+
+    succeeded, failed = dispatcher.multicast('token', user_ids, [{'type': 'text', 'text': 'test'}])
+
+    assert sorted(succeeded) == sorted(user_ids[:500] + user_ids[1000:])
+    assert [result['to'] for result in failed] == [user_ids[500:1000]]
+    assert 'ValueError' in failed[0]['error']
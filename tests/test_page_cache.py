@@ -0,0 +1,113 @@
+import json
+
+import crawler
+from conftest import FakeSite, read_fixture
+from extractors import SoupExtractor
+from page_cache import PageCache
+from utils import base_url
+
+
+EVENT_URL = f"{base_url}/events/detail/101"
+
+
+class CountingParser:
+    """呼び出し回数を数える解析関数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text: str):
+        self.calls += 1
+        return SoupExtractor().performs(text)
+
+
+def new_crawler(tmp_path):
+    """キャッシュファイルから読み込み直したクローラーを作る（次回の実行に相当）"""
+    cache = PageCache(str(tmp_path / 'cache.json'))
+    cache.load()
+    return crawler.Crawler(cache=cache, extractor=SoupExtractor())
+
+
+def test_not_modified_reuses_cached_result(monkeypatch, tmp_path):
+    site = FakeSite()
+    site.serve(EVENT_URL, read_fixture('event_available.html'), etag='"v1"')
+    monkeypatch.setattr(crawler, 'session', site)
+    parser = CountingParser()
+
+    c = new_crawler(tmp_path)
+    first = c.fetch(EVENT_URL, parser)
+    c.cache.save()
+    second = new_crawler(tmp_path).fetch(EVENT_URL, parser)
+
+    assert second == first
+    assert parser.calls == 1
+    assert site.requests[1] == (EVENT_URL, {'If-None-Match': '"v1"'})
+
+
+def test_not_modified_without_cached_result_refetches(monkeypatch, tmp_path):
+    site = FakeSite()
+    site.serve(EVENT_URL, read_fixture('event_available.html'), etag='"v1"')
+    monkeypatch.setattr(crawler, 'session', site)
+    parser = CountingParser()
+    c = new_crawler(tmp_path)
+    # 検証子だけが残り、解析結果が失われたエントリ
+    c.cache.entries[EVENT_URL] = {'etag': '"v1"', 'last_modified': None, 'hash': None, 'result': None}
+
+    performs = c.fetch(EVENT_URL, parser)
+
+    assert performs == SoupExtractor().performs(read_fixture('event_available.html').decode('utf-8'))
+    assert parser.calls == 1
+    assert site.requests == [(EVENT_URL, {'If-None-Match': '"v1"'}), (EVENT_URL, {})]
+
+
+def test_save_evicts_urls_no_longer_linked(monkeypatch, tmp_path):
+    site = FakeSite()
+    site.serve(f"{base_url}/events/artist/101", read_fixture('artist_news.html'))
+    for event_id in (101, 102, 104):
+        site.serve(f"{base_url}/events/detail/{event_id}", read_fixture('event_sold_out.html'), etag=f'"{event_id}"')
+    monkeypatch.setattr(crawler, 'session', site)
+
+    new_crawler(tmp_path).crawl({'news': 101})
+    # 2回目はイベント101だけがアーティストページに残っている
+    artist_page = read_fixture('artist_news.html').decode('utf-8')
+    for event_id in (102, 104):
+        artist_page = artist_page.replace(f'href="events/detail/{event_id}"', 'href=""')
+    site.serve(f"{base_url}/events/artist/101", artist_page.encode('utf-8'))
+    new_crawler(tmp_path).crawl({'news': 101})
+
+    with open(tmp_path / 'cache.json', encoding='utf-8') as f:
+        entries = json.load(f)
+    assert sorted(entries) == [f"{base_url}/events/artist/101", f"{base_url}/events/detail/101"]
+
+
+def test_unchanged_body_skips_parser(monkeypatch, tmp_path):
+    site = FakeSite()
+    # 検証子を返さないサーバー
+    site.serve(EVENT_URL, read_fixture('event_available.html'))
+    monkeypatch.setattr(crawler, 'session', site)
+    parser = CountingParser()
+
+    c = new_crawler(tmp_path)
+    first = c.fetch(EVENT_URL, parser)
+    c.cache.save()
+    second = new_crawler(tmp_path).fetch(EVENT_URL, parser)
+
+    assert second == first
+    assert parser.calls == 1
+    assert site.requests[1] == (EVENT_URL, {})
+
+
+def test_changed_body_is_parsed_again(monkeypatch, tmp_path):
+    site = FakeSite()
+    site.serve(EVENT_URL, read_fixture('event_available.html'))
+    monkeypatch.setattr(crawler, 'session', site)
+    parser = CountingParser()
+
+    c = new_crawler(tmp_path)
+    c.fetch(EVENT_URL, parser)
+    c.cache.save()
+    site.serve(EVENT_URL, read_fixture('event_sold_out.html'))
+    performs = new_crawler(tmp_path).fetch(EVENT_URL, parser)
+
+    assert performs == SoupExtractor().performs(read_fixture('event_sold_out.html').decode('utf-8'))
+    assert parser.calls == 2
@@ -0,0 +1,47 @@
+import planner
+
+
+class FakeLineClient:
+    """送信数の上限の取得回数を数える LineClient の代わり"""
+
+    def __init__(self, limit: int, usage: int):
+        self.limit = limit
+        self.usage = usage
+        self.calls = 0
+
+    def get_quota(self):
+        self.calls += 1
+        return {'type': 'limited', 'value': self.limit}
+
+    def get_quota_consumption(self):
+        self.calls += 1
+        return {'totalUsage': self.usage}
+
+
+def notification(artist: str, date: str, users: int):
+    return {
+        'artist': artist,
+        'tickets': [{'date': date, 'place': '東京ドーム', 'url': 'https://relief-ticket.jp/events/1'}],
+        'subscriber_count': users,
+        'users': [f'{artist}-{i}' for i in range(users)]
+    }
+
+
+def test_no_notifications_skip_quota_calls(monkeypatch):
+    monkeypatch.setitem(planner._quota_cache, 'expires_at', 0)
+    client = FakeLineClient(1000, 0)
+
+    assert planner.plan_notifications(client, []) == ([], [])
+    assert client.calls == 0
+
+
+def test_soonest_perform_is_planned_first(monkeypatch):
+    monkeypatch.setitem(planner._quota_cache, 'expires_at', 0)
+    client = FakeLineClient(1000, 995)
+    later = notification('news', '2025/09/01(月) 18:00', 5)
+    sooner = notification('snowman', '2025/08/01(金) 18:00', 5)
+
+    planned, deferred = planner.plan_notifications(client, [later, sooner])
+
+    assert [(n['artist'], len(n['users'])) for n in planned] == [('snowman', 5)]
+    assert [(n['artist'], len(n['users'])) for n in deferred] == [('news', 5)]
@@ -0,0 +1,89 @@
+import importlib
+import json
+
+import pytest
+
+from conftest import function_modules
+
+
+@pytest.fixture
+def push_app(users_table):
+    with function_modules('push_notification', ('app', 'delivery', 'dispatcher')):
+        yield importlib.import_module('app')
+
+
+def test_webhook_verification_needs_no_token(push_app, monkeypatch):
+    def unavailable(*args):
+        raise AssertionError('SSM or the token was used')
+
+    monkeypatch.setattr(importlib.import_module('delivery'), 'get_ssm_parameter', unavailable)
+    monkeypatch.setattr(importlib.import_module('delivery'), 'get_token', unavailable)
+
+    response = push_app.lambda_handler({'body': json.dumps({'destination': 'U0', 'events': []})}, None)
+
+    assert response['statusCode'] == 200
+
+
+def test_token_is_resolved_once_per_delivery(push_app, monkeypatch):
+    delivery = importlib.import_module('delivery')
+    calls = []
+    replies = []
+
+    class FakeLineClient:
+        def __init__(self, token):
+            self.token = token
+
+        def reply(self, reply_token, messages):
+            replies.append((self.token, reply_token))
+            return type('Response', (), {'json': lambda self: {}})()
+
+    monkeypatch.setattr(delivery, 'get_ssm_parameter', lambda name: name)
+    monkeypatch.setattr(delivery, 'get_token', lambda channel_id, channel_secret: calls.append(1) or 'token')
+    monkeypatch.setattr(delivery, 'LineClient', FakeLineClient)
+    events = [
+        {'type': 'message', 'source': {'userId': f'U{i}'}, 'replyToken': f'r{i}', 'message': {'text': '設定を変更'}}
+        for i in range(20)
+    ]
+
+    response = push_app.lambda_handler({'body': json.dumps({'events': events})}, None)
+
+    assert response['statusCode'] == 200
+    assert calls == [1]
+    assert sorted(replies) == sorted(('token', f'r{i}') for i in range(20))
+
+
+def test_events_share_the_dynamodb_client_in_user_order(push_app, monkeypatch):
+    delivery = importlib.import_module('delivery')
+    replies = {}
+
+    class FakeLineClient:
+        def __init__(self, token):
+            pass
+
+        def reply(self, reply_token, messages):
+            replies[reply_token] = messages[0]['text']
+            return type('Response', (), {'json': lambda self: {}})()
+
+        def push(self, to, messages, retry_key=None):
+            return type('Response', (), {'json': lambda self: {}})()
+
+    monkeypatch.setattr(delivery, 'get_ssm_parameter', lambda name: name)
+    monkeypatch.setattr(delivery, 'get_token', lambda channel_id, channel_secret: 'token')
+    monkeypatch.setattr(delivery, 'LineClient', FakeLineClient)
+    monkeypatch.setattr(push_app, 'get_ssm_parameter', lambda name: name)
+    events = []
+    for i in range(8):
+        events += [
+            {'type': 'follow', 'source': {'userId': f'U{i}'}},
+            {'type': 'postback', 'source': {'userId': f'U{i}'}, 'replyToken': f'set-{i}', 'postback': {'data': 'artist=news'}},
+            {'type': 'message', 'source': {'userId': f'U{i}'}, 'replyToken': f'check-{i}', 'message': {'text': '現在の設定を確認'}},
+        ]
+    # 1人だけ未知のアーティストを登録しようとして失敗する
+    events[1]['postback']['data'] = 'artist=unknown'
+
+    response = push_app.lambda_handler({'body': json.dumps({'events': events})}, None)
+
+    # 失敗したイベントは報告されるが、他のイベントは処理される
+    assert response['statusCode'] == 500
+    for i in range(1, 8):
+        assert replies[f'check-{i}'] == '現在のアーティスト設定: NEWS'
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import read_fixture
+from extractors import SoupExtractor, StreamExtractor, iter_performs
+
+
+PAGES = [
+    ('event_available.html', 'utf-8'),
+    ('event_sold_out.html', 'utf-8'),
+    ('event_available_sjis.html', 'shift_jis'),
+    ('event_multiple_sections.html', 'utf-8'),
+]
+
+
+def chunked(content: bytes, size: int):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+@pytest.mark.parametrize('name, encoding', PAGES)
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 16384])
+@pytest.mark.parametrize('end_tag', [None, 'main'])
+def test_stream_matches_full_parse(name, encoding, chunk_size, end_tag):
+    content = read_fixture(name)
+    full = SoupExtractor(restricted=False).performs(content.decode(encoding))
+
+    assert list(iter_performs(chunked(content, chunk_size), encoding, end_tag)) == full
+
+
+def test_stream_reads_perform_lists_in_later_sections():
+    content = read_fixture('event_multiple_sections.html')
+
+    performs = list(iter_performs(chunked(content, 64), 'utf-8'))
+
+    assert [perform['available'] for perform in performs] == [False, False, True]
+
+
+def test_stream_stops_after_end_tag():
+    content = read_fixture('event_available.html')
+    chunks = chunked(content, 64)
+    read = []
+
+    def reading():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    list(iter_performs(reading(), 'utf-8', 'main'))
+
+    assert len(read) < len(chunks)
+
+
+@pytest.mark.parametrize('name, encoding', PAGES)
+def test_stream_extractor_matches_full_parse(name, encoding):
+    html = read_fixture(name).decode(encoding)
+
+    assert StreamExtractor().performs(html) == SoupExtractor(restricted=False).performs(html)
+
+
+def test_stream_closes_unclosed_place_with_its_div():
+    html = (
+        '<main><div class="perform-list"><div class="lead">2025/10/04(土) 17:00</div>'
+        '<div class="place"><p>バンテリンドーム ナゴヤ</div><button class="btn">購入手続きへ</button></div>'
+        '<div class="perform-list"><div class="lead">2025/10/05(日) 17:00</div><p>バンテリンドーム ナゴヤ</div></main>'
+    )
+
+    performs = list(iter_performs(chunked(html.encode('utf-8'), 7), 'utf-8'))
+
+    assert performs == SoupExtractor(restricted=False).performs(html)
+    assert [perform['available'] for perform in performs] == [True, False]
@@ -0,0 +1,118 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import line_client
+import utils
+
+
+@pytest.fixture
+def token_cache(token_cache_table, monkeypatch):
+    monkeypatch.setattr(utils, 'token_cache_stats', utils.Counter())
+    utils.invalidate_token()
+
+    # moto は条件付き書き込みをスレッド間で排他しないため、DynamoDB と同じく1件ずつ処理させる
+    acquire = utils.acquire_refresh_lease
+    lock = threading.Lock()
+
+    def atomic_acquire(owner):
+        with lock:
+            return acquire(owner)
+
+    monkeypatch.setattr(utils, 'acquire_refresh_lease', atomic_acquire)
+    return token_cache_table
+
+
+@pytest.fixture
+def issued(monkeypatch):
+    """発行したトークンを記録し、発行に時間がかかる /v2/oauth/accessToken の代わり"""
+    tokens = []
+    lock = threading.Lock()
+
+    def issue_token(self, channel_id, channel_secret):
+        time.sleep(0.5)
+        with lock:
+            tokens.append(f'token-{len(tokens)}')
+            return {'access_token': tokens[-1], 'expires_in': 2592000}
+
+    monkeypatch.setattr(line_client.LineClient, 'issue_token', issue_token)
+    return tokens
+
+
+def test_concurrent_refresh_issues_one_token(token_cache, issued):
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        tokens = list(executor.map(lambda _: utils.refresh_token('id', 'secret')['access_token'], range(10)))
+
+    assert issued == ['token-0']
+    assert tokens == ['token-0'] * 10
+
+
+def test_lease_winner_reuses_token_refreshed_just_before(token_cache, issued):
+    token_cache.put_item(Item={'token_type': 'channel_access_token', 'access_token': 'fresh', 'expires_at': int(time.time()) + 3600})
+
+    assert utils.refresh_token('id', 'secret')['access_token'] == 'fresh'
+    assert issued == []
+    # リースは解放されている
+    assert utils.acquire_refresh_lease('next')
+
+
+def test_waiter_does_not_issue_when_holder_is_slow(token_cache, issued, monkeypatch):
+    monkeypatch.setattr(utils, 'TOKEN_LEASE_WAIT', 0.5)
+    assert utils.acquire_refresh_lease('slow-holder')
+
+    with pytest.raises(RuntimeError):
+        utils.refresh_token('id', 'secret')
+    assert issued == []
+
+
+def test_waiter_keeps_valid_current_token(token_cache, issued):
+    current = {'access_token': 'current', 'expires_at': int(time.time()) + 600}
+    assert utils.acquire_refresh_lease('holder')
+
+    assert utils.refresh_token('id', 'secret', current)['access_token'] == 'current'
+    assert issued == []
+
+
+def test_lease_outlasts_the_oauth_retry_budget():
+    assert utils.TOKEN_LEASE_SECONDS > line_client.max_request_seconds()
+
+
+def test_polling_does_not_count_as_cache_miss(token_cache, issued):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: utils.get_token('id', 'secret'), range(4)))
+
+    assert utils.token_cache_stats['dynamodb_miss'] <= 4
+    assert issued == ['token-0']
+
+
+
+class UnauthorizedSession:
+    """すべてのリクエストに 401 を返す session の代わり"""
+
+    def request(self, method, url, **kwargs):
+        res = requests.Response()
+        res.status_code = 401
+        res._content = b'{}'
+        return res
+
+
+def test_rejected_token_is_dropped_from_memory(token_cache, issued, monkeypatch):
+    token_cache.put_item(Item={'token_type': 'channel_access_token', 'access_token': 'revoked', 'expires_at': int(time.time()) + 3600})
+    assert utils.get_token('id', 'secret') == 'revoked'
+    monkeypatch.setattr(line_client, 'session', UnauthorizedSession())
+
+    with pytest.raises(requests.HTTPError):
+        line_client.LineClient('revoked').push('U1', [])
+
+    assert utils.get_memory_token() is None
+
+
+def test_rejection_of_old_token_keeps_current_one(token_cache):
+    utils._promote_token('current', int(time.time()) + 3600)
+
+    utils.invalidate_token('old')
+
+    assert utils.get_memory_token() == 'current'